@@ -0,0 +1,204 @@
+import os
+import time
+import numpy as np
+
+# Benchmarks for the dataFoam readers/writers. Run from the dataFoam folder: python benchmarks.py
+dataFoam_folder = os.getcwd()
+
+def time_call(function,*args,repeats=5):
+    # Returns the best wall time of repeats calls, and the result of the last call.
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best,time.perf_counter()-start)
+    return best, result
+
+def benchmark_readFoamField():
+    # Native internalField parser vs Ofpp, on the test_data/case_1p0 fields (and the example DNS symmTensor fields).
+    import Ofpp
+    from utilities.foamIO.readFoam import parse_internal_field
+    files = [os.path.join(dataFoam_folder,'test_data/case_1p0/20000',field) for field in ['k','nut','omega','p','phi','U']]
+    files += [os.path.join(dataFoam_folder,'example_data/case_1p0_DNS/0',field) for field in ['TauDNS','Tau_rans']]
+    print(f'[dataFoam benchmarks] readFoamField: native parser vs Ofpp.parse_internal_field')
+    total_ofpp, total_native = 0, 0
+    for file in files:
+        t_ofpp, field_ofpp = time_call(Ofpp.parse_internal_field,file)
+        t_native, field_native = time_call(parse_internal_field,file)
+        assert np.array_equal(field_ofpp,field_native), f'Fields differ for {file}'
+        total_ofpp += t_ofpp
+        total_native += t_native
+        print(f'    {os.path.basename(file):10s} shape {str(np.shape(field_native)):12s} Ofpp {t_ofpp*1E3:8.2f} ms, native {t_native*1E3:8.2f} ms, speedup {t_ofpp/t_native:5.1f}x, bit-identical')
+    print(f'    Total: Ofpp {total_ofpp*1E3:.2f} ms, native {total_native*1E3:.2f} ms, speedup {total_ofpp/total_native:.1f}x')
+
+def write_binary_copy(ascii_file,output_file,compress=False):
+    # Writes a binary (optionally gzipped) copy of an ascii foam field, keeping its header and boundaryField.
+    import gzip
+    import re
+    from utilities.foamIO.readFoam import parse_internal_field
+    content = open(ascii_file,'rb').read()
+    field = parse_internal_field(ascii_file)
+    header = re.search(rb'^\s*internalField\s+nonuniform\s+List<\w+>\s*\d+\s*', content, re.M)
+    end = content.index(b';',header.end())
+    binary_content = content[:header.end()].replace(b'format      ascii;',b'format      binary;\n    arch        "LSB;label=32;scalar=64";') \
+                     + b'(' + np.ascontiguousarray(field,dtype='<f8').tobytes() + b')' + content[end:]
+    with (gzip.open(output_file+'.gz','wb') if compress else open(output_file,'wb')) as f:
+        f.write(binary_content)
+
+def benchmark_binary_readFoamField():
+    # Binary and gzipped binary reads vs ascii reads of the same fields.
+    import tempfile
+    from utilities.foamIO.readFoam import parse_internal_field
+    print(f'[dataFoam benchmarks] readFoamField: ascii vs binary vs binary+gzip')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for field in ['k','phi','U']:
+            ascii_file = os.path.join(dataFoam_folder,'test_data/case_1p0/20000',field)
+            write_binary_copy(ascii_file,os.path.join(tmp_dir,field))
+            write_binary_copy(ascii_file,os.path.join(tmp_dir,field+'_compressed'),compress=True)
+            t_ascii, field_ascii = time_call(parse_internal_field,ascii_file)
+            t_binary, field_binary = time_call(parse_internal_field,os.path.join(tmp_dir,field))
+            t_gzip, field_gzip = time_call(parse_internal_field,os.path.join(tmp_dir,field+'_compressed'))
+            assert np.array_equal(field_ascii,field_binary) and np.array_equal(field_ascii,field_gzip)
+            print(f'    {field:10s} ascii {t_ascii*1E3:8.2f} ms, binary {t_binary*1E3:8.3f} ms ({field_binary.nbytes/t_binary/1E9:.2f} GB/s), binary+gzip {t_gzip*1E3:8.2f} ms')
+
+def benchmark_dataset_container(n_cells=100000):
+    # One .npy per field vs a single HDF5 container, for a RANS-like case with 100+ fields.
+    import tempfile
+    from utilities.datasetContainer import FoamDatasetContainer, load_container_fields
+    fields = {f'I{j}_{i+1}': np.random.rand(n_cells) for i in range(47) for j in [1,2]}
+    fields.update({f'T{i+1}': np.random.rand(n_cells,3,3) for i in range(10)})
+    fields.update({field: np.random.rand(n_cells,3) for field in ['U','gradp','gradk','C']})
+    fields.update({field: np.random.rand(n_cells,3,3) for field in ['gradU','S','R']})
+    subset = ['U','T1','I1_1','I2_1','S']
+    print(f'[dataFoam benchmarks] Dataset layout: {len(fields)} fields, {n_cells} cells')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for field, data in fields.items():
+            np.save(os.path.join(tmp_dir,f'prefix_{field}.npy'),data)
+        for compression in [None,'lzf']:
+            with FoamDatasetContainer(os.path.join(tmp_dir,f'prefix_{compression}.h5'),mode='a',compression=compression) as container:
+                for field, data in fields.items():
+                    container.write_field(field,data)
+        load_npy = lambda names: {field: np.load(os.path.join(tmp_dir,f'prefix_{field}.npy')) for field in names}
+        t_npy_all, _ = time_call(load_npy,list(fields),repeats=3)
+        t_npy_subset, _ = time_call(load_npy,subset,repeats=3)
+        print(f'    npy:            {len(fields)} files, load all {t_npy_all*1E3:8.1f} ms, load {len(subset)} fields {t_npy_subset*1E3:6.1f} ms')
+        for compression in [None,'lzf']:
+            container_file = os.path.join(tmp_dir,f'prefix_{compression}.h5')
+            t_all, loaded = time_call(load_container_fields,container_file,repeats=3)
+            t_subset, _ = time_call(load_container_fields,container_file,subset,repeats=3)
+            assert all(np.array_equal(loaded[field],fields[field]) for field in fields)
+            print(f'    hdf5 ({str(compression):4s}):    1 file ({os.path.getsize(container_file)/1E6:.0f} MB), load all {t_all*1E3:8.1f} ms, load {len(subset)} fields {t_subset*1E3:6.1f} ms')
+
+def benchmark_map_coarse_fine(n_fine=200000,n_coarse=20000):
+    # griddata vs FineCoarseMapper component by component vs all components of each field in one product,
+    # for the fields of a DNS dataset (scalars, vectors and N x 3 x 3 tensors).
+    from scipy.interpolate import griddata
+    from preprocessing.map_coarse_fine import FineCoarseMapper
+    rng = np.random.default_rng(0)
+    C_fine, C_coarse = rng.random((n_fine,2)), rng.random((n_coarse,2))
+    fields = [rng.random(n_fine) for _ in range(5)] + [rng.random((n_fine,3)) for _ in range(5)] + [rng.random((n_fine,3,3)) for _ in range(20)]
+    n_components = sum(field[0].size for field in fields)
+    print(f'[dataFoam benchmarks] map_coarse_fine: {len(fields)} fields ({n_components} components), {n_fine} -> {n_coarse} points')
+    t_griddata, _ = time_call(griddata,C_fine,fields[-1].reshape(n_fine,-1),C_coarse,'linear',repeats=1)
+    t_weights, mapper = time_call(FineCoarseMapper,C_fine,C_coarse,'linear',repeats=1)
+    map_components = lambda: [mapper.map(column) for field in fields for column in field.reshape(n_fine,-1).T]
+    t_components, _ = time_call(map_components,repeats=3)
+    t_fields, mapped = time_call(mapper.map_fields,fields,repeats=3)
+    reference = griddata(C_fine,fields[-1].reshape(n_fine,-1),C_coarse,'linear')
+    inside = ~np.isnan(reference).any(axis=1) # the mapper fills points outside the convex hull with nearest
+    assert np.allclose(mapped[-1].reshape(n_coarse,-1)[inside],reference[inside])
+    print(f'    griddata (one tensor field):  {t_griddata:8.2f} s, ~{t_griddata*len(fields):.1f} s for all fields')
+    print(f'    mapper weights:               {t_weights:8.2f} s')
+    print(f'    mapper, by component:         {t_components*1E3:8.1f} ms ({n_components*n_coarse/t_components/1E6:.0f} M values/s)')
+    print(f'    mapper, by field (N x K):     {t_fields*1E3:8.1f} ms ({n_components*n_coarse/t_fields/1E6:.0f} M values/s)')
+
+def benchmark_volume_average(n_fine=500,refinement=10,wavenumber=200):
+    # Linear point interpolation vs volume_average, for a uniform n_fine x n_fine mesh averaged onto a mesh refinement^2 times coarser.
+    # The fine values are exact cell averages of sin(wavenumber*x) + y, so the exact coarse cell averages are known.
+    from preprocessing.map_coarse_fine import FineCoarseMapper
+    def get_mesh(n):
+        edges = np.linspace(0,1,n+1)
+        x, y = np.meshgrid((edges[1:]+edges[:-1])/2,(edges[1:]+edges[:-1])/2,indexing='ij')
+        field = (np.cos(wavenumber*edges[:-1])-np.cos(wavenumber*edges[1:]))[:,None]/(wavenumber/n) + y
+        return np.column_stack([x.ravel(),y.ravel()]), field.ravel(), np.full(n*n,1/n**2)
+    C_fine, field_fine, V_fine = get_mesh(n_fine)
+    C_coarse, field_exact, _ = get_mesh(n_fine//refinement)
+    print(f'[dataFoam benchmarks] map_coarse_fine: {len(C_fine)} -> {len(C_coarse)} cells ({refinement**2}x refinement)')
+    for method in ['linear','volume_average']:
+        t_weights, mapper = time_call(FineCoarseMapper,C_fine,C_coarse,method,V_fine,repeats=1)
+        error = np.max(abs(mapper.map(field_fine)-field_exact))
+        print(f'    {method:15s} weights {t_weights:6.2f} s, max error vs exact cell averages {error:.2e}')
+
+def benchmark_nnls_fit(n_cells=2000):
+    # Vectorized closed-form nnls nut fit vs the per-cell sklearn LinearRegression(positive=True) fit it replaces.
+    from sklearn.metrics import r2_score
+    from sklearn.linear_model import LinearRegression
+    from preprocessing.calculate_optimal_fits import nnls_fit, SYMM_TENSOR_COMPONENTS
+    def sklearn_nnls_fit(S,a):
+        X = -2*S.reshape(9)[SYMM_TENSOR_COMPONENTS].reshape(-1,1)
+        y = a.reshape(9)[SYMM_TENSOR_COMPONENTS].reshape(-1,1)
+        reg_nnls = LinearRegression(positive=True,fit_intercept = False).fit(X,y)
+        return reg_nnls.coef_[0,0], r2_score(y,reg_nnls.predict(X))
+    rng = np.random.default_rng(0)
+    S = rng.normal(size=(n_cells,3,3))
+    S = S + S.transpose(0,2,1)
+    a = -2*rng.normal(0.01,0.02,size=n_cells)[:,None,None]*S + rng.normal(scale=0.01,size=(n_cells,3,3))
+    a = a + a.transpose(0,2,1)
+    print(f'[dataFoam benchmarks] calculate_optimal_fits.nnls_fit: {n_cells} cells')
+    t_sklearn, results = time_call(lambda: np.array([sklearn_nnls_fit(Si,ai) for Si, ai in zip(S,a)]),repeats=1)
+    t_vectorized, (nut_nnls, r2_nnls) = time_call(nnls_fit,S,a)
+    assert np.allclose(nut_nnls,results[:,0],rtol=1E-12,atol=1E-15) and np.allclose(r2_nnls,results[:,1],rtol=1E-12,atol=1E-12)
+    print(f'    sklearn per cell {t_sklearn*1E3:9.1f} ms, vectorized {t_vectorized*1E3:7.3f} ms, speedup {t_sklearn/t_vectorized:.0f}x, same nut and r2')
+
+def benchmark_rans_features(n_cells=100000):
+    # All writeFields_RANS features (T1-T10, I1_/I2_1-47, lambdas, q's) computed in numpy from the primitive fields.
+    from preprocessing.calculate_rans_features import calc_rans_features
+    rng = np.random.default_rng(0)
+    gradU = rng.normal(size=(n_cells,3,3))
+    k, omega, nut, wallDistance = rng.random(n_cells)+0.1, rng.random(n_cells)+0.1, rng.random(n_cells)*1E-3, rng.random(n_cells)+0.01
+    gradk, gradomega = rng.normal(size=(n_cells,3)), rng.normal(size=(n_cells,3))
+    t_features, fields = time_call(lambda: calc_rans_features(gradU,k,nut,5E-6,omega=omega,wallDistance=wallDistance,gradk=gradk,gradomega=gradomega),repeats=3)
+    print(f'[dataFoam benchmarks] calculate_rans_features: {n_cells} cells')
+    print(f'    {len(fields)} fields in {t_features:.2f} s ({n_cells/t_features/1E6:.2f} M cells/s)')
+
+def benchmark_write_foam_list(n_cells=1000000):
+    # Shared write_foam_list vs the np.savetxt of string arrays previously used by the writeFoam_* functions, for aperp and nut_L sized fields,
+    # and the same lists written as binary (and gzipped binary).
+    import io
+    import tempfile
+    from utilities.foamIO.writeFoam import write_foam_list, FoamFieldFile
+    def savetxt_foam_list(file,field):
+        if field.ndim > 1:
+            field = np.column_stack((np.repeat('(',len(field)),field,np.repeat(')',len(field))))
+        np.savetxt(file,field,fmt='%s')
+    def write_binary(filename,field,write_compression):
+        with FoamFieldFile(filename,'binary',write_compression) as file:
+            file.write('FoamFile\n{\n    format      ascii;\n}\ninternalField nonuniform List<scalar>\n')
+            file.write_list(field)
+            file.write(');\n')
+    def write_text(write,field):
+        file = io.StringIO()
+        write(file,field)
+        return file.getvalue()
+    rng = np.random.default_rng(0)
+    print(f'[dataFoam benchmarks] writeFoam: {n_cells} cells')
+    for field_name, field in [('nut_L',rng.random(n_cells)*1E-3),('aperp',rng.normal(size=(n_cells,6))*1E-4)]:
+        t_savetxt, text_savetxt = time_call(write_text,savetxt_foam_list,field,repeats=1)
+        t_shared, text_shared = time_call(write_text,write_foam_list,field,repeats=1)
+        assert text_savetxt == text_shared
+        print(f'    {field_name:6s} savetxt {t_savetxt:6.2f} s, write_foam_list {t_shared:6.2f} s, speedup {t_savetxt/t_shared:.1f}x, identical text ({len(text_shared)/1E6:.0f} MB)')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for write_compression in [False,True]:
+                t_binary, _ = time_call(write_binary,os.path.join(tmp_dir,field_name),field,write_compression,repeats=1)
+                size = os.path.getsize(os.path.join(tmp_dir,field_name+('.gz' if write_compression else '')))
+                print(f'    {field_name:6s} {"binary+gzip" if write_compression else "binary":11s} {t_binary*1E3:8.1f} ms ({size/1E6:.0f} MB)')
+
+if __name__ == '__main__':
+    benchmark_readFoamField()
+    benchmark_binary_readFoamField()
+    benchmark_dataset_container()
+    benchmark_map_coarse_fine()
+    benchmark_volume_average()
+    benchmark_nnls_fit()
+    benchmark_rans_features()
+    benchmark_write_foam_list()
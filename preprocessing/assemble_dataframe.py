@@ -3,6 +3,11 @@
 import os
 import numpy as np
 import pandas as pd
+from dataFoam.utilities.dataset import load_case_field, load_case_field_shape
+
+# Upper triangle components (i,j) written for symmetric tensors
+SYMM_COMPONENTS = [(0,0),(0,1),(0,2),(1,1),(1,2),(2,2)]
+
 def assemble_dataframe(data_parent_dir: str,
                        field_dict: dict,
                        case_name_list: list, 
@@ -31,73 +36,9 @@ def assemble_dataframe(data_parent_dir: str,
         
         print(f'    Case: {case}')
 
-        # dataframe containing data from current case
-        dataframe_case = pd.DataFrame()
-
-        # Loop over field generation method
-        for field_dir in field_dict:
-            #
-            print(f'        {field_dir}')
-
-            # Loop over field name
-            for field_name in field_dict[field_dir]:
-                print(f'            {field_name}')
-
-                # Try to load the numpy field, fill with NaNs if it cant be found
-                try: 
-                    field = np.float32(np.load(os.path.join(data_parent_dir,field_dir,field_dir+'_'+case+'_'+field_name+'.npy')))
-                    field_type = get_field_type(field_name,field)
-                except:
-                    # Need to get the length of the NaN array somehow - current (hacky) solution is to take the length of the U field, since every simulation type has a U field.
-                    print(f'            {field_name} not found.')
-                    field_type = None
-                    #len_field = len(np.float32(np.load(os.path.join(data_parent_dir,field_dir,field_dir+'_'+case+'_'+'U'+'.npy'))))
-                    #field = np.empty(len_field)
-                    #field[:] = np.nan
-                    #dataframe_case = add_data(dataframe_case,field_dir,field_name,field)
-
-                # Depending on the field type, add different entry format to the dataframe. Since the dataframe is tabular, it needs columns, and tensors need to be split up into individual entries.
-
-                # Scalars can be added directly
-                if field_type == 'scalar':
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name,field)
-
-                # Vectors and matrices should be added one component at a time
-                if field_type == 'vector':
-                    for i in range(field.shape[1]):
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1),field[:,i])
-
-                if field_type == 'matrix':
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_11',field[:,0,0])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_12',field[:,0,1])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_13',field[:,0,2])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_21',field[:,1,0])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_22',field[:,1,1])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_23',field[:,1,2])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_31',field[:,2,0])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_32',field[:,2,1])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_33',field[:,2,2])
-                    
-                if field_type == 'symm_matrix':
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_11',field[:,0,0])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_12',field[:,0,1])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_13',field[:,0,2])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_22',field[:,1,1])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_23',field[:,1,2])
-                    dataframe_case = add_data(dataframe_case,field_dir,field_name+'_33',field[:,2,2])
-
-                # The Tensor basis field requires special handling, since it is of shape [N,10,3,3]
-                if field_type == 'tensor_basis':
-                    for i in range(10):
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1)+'_11',field[:,i,0,0])
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1)+'_12',field[:,i,0,1])
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1)+'_13',field[:,i,0,2])
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1)+'_22',field[:,i,1,1])
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1)+'_23',field[:,i,1,2])
-                        dataframe_case = add_data(dataframe_case,field_dir,field_name+'_'+str(i+1)+'_33',field[:,i,2,2])
-
-        # Convert to float 32
-        dataframe_case=dataframe_case.astype('float32')
+        # dataframe containing data from current case, built in one go from the column arrays
+        columns = get_case_columns(data_parent_dir,field_dict,case)
+        dataframe_case = pd.DataFrame({column_name: column.astype('float32') for column_name, column in columns})
 
         # Add a Case entry to the dataframe
         dataframe_case['Case'] = case
@@ -115,9 +56,112 @@ def assemble_dataframe(data_parent_dir: str,
     dataframe_main.to_csv(output_file)
     print('Finished saving dataframe.')
 
-def get_field_type(fieldname,field):
-    # Determine field type based on number of dimensions, and for symmetric matrices, the fieldname itself.
-    ndims = field.ndim
+def assemble_parquet(data_parent_dir: str,
+                     field_dict: dict,
+                     case_name_list: list,
+                     output_file: str,
+                     compression: str = 'snappy',
+                     row_group_size: int = None):
+    """
+    Columnar version of assemble_dataframe, writing a parquet file instead of a csv file.
+    Takes the same data_parent_dir, field_dict and case_name_list, and produces the same columns ({dir}_{field}_{ij}, float32) and Case column.
+    Cases are written one at a time (as one or more row groups of row_group_size rows), with each column taken straight from the memory-mapped
+    numpy fields, so peak memory is bounded by one case. Columns missing from a case are filled with NaNs, as in the csv file.
+    Requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    print('[dataFoam] Assembling parquet file for cases: '+str(case_name_list)+', outputting to '+output_file)
+
+    # The schema is the union of the columns of every case. Only the field shapes are read here (.npy headers, or the container index).
+    column_names = []
+    for case in case_name_list:
+        for column_name in get_case_column_names(data_parent_dir,field_dict,case):
+            if column_name not in column_names:
+                column_names.append(column_name)
+    schema = pa.schema([(column_name, pa.float32()) for column_name in column_names]+[('Case', pa.dictionary(pa.int32(), pa.string()))])
+
+    with pq.ParquetWriter(output_file,schema,compression=compression) as writer:
+        for case in case_name_list:
+            print(f'    Case: {case}')
+            columns = dict(get_case_columns(data_parent_dir,field_dict,case))
+            if len(columns) == 0:
+                print(f'    No fields found for {case}, skipping.')
+                continue
+            n_rows = len(next(iter(columns.values())))
+            arrays = [pa.array(np.ascontiguousarray(columns[column_name],dtype=np.float32)) if column_name in columns
+                      else pa.array(np.full(n_rows,np.nan,dtype=np.float32)) for column_name in column_names]
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(np.zeros(n_rows,dtype=np.int32)),pa.array([case])))
+            writer.write_table(pa.Table.from_arrays(arrays,schema=schema),row_group_size=row_group_size)
+    print('Finished saving parquet file.')
+
+def get_case_columns(data_parent_dir,field_dict,case,verbose=True):
+    """
+    Returns the list of (column name, 1D column) for one case. Columns are views into the memory-mapped numpy fields.
+    Depending on the field type, different entries are added. Since the output is tabular, tensors need to be split up into individual entries.
+    """
+    columns = []
+    # Loop over field generation method
+    for field_dir in field_dict:
+        if verbose:
+            print(f'        {field_dir}')
+
+        # Loop over field name
+        for field_name in field_dict[field_dir]:
+            if verbose:
+                print(f'            {field_name}')
+
+            # Try to load the numpy field, skip it if it cant be found
+            try: 
+                field = load_case_field(os.path.join(data_parent_dir,field_dir),field_dir+'_'+case,field_name,mmap_mode='r')
+            except:
+                if verbose:
+                    print(f'            {field_name} not found.')
+                continue
+            for column_name, component in get_field_components(field_dir+'_'+field_name,field_name,field.shape):
+                columns.append((column_name,field[(slice(None),)+component]))
+    return columns
+
+def get_case_column_names(data_parent_dir,field_dict,case):
+    # Column names of get_case_columns, from the field shapes alone, so no field data is read
+    column_names = []
+    for field_dir in field_dict:
+        for field_name in field_dict[field_dir]:
+            try:
+                shape = load_case_field_shape(os.path.join(data_parent_dir,field_dir),field_dir+'_'+case,field_name)
+            except:
+                continue
+            column_names += [column_name for column_name, _ in get_field_components(field_dir+'_'+field_name,field_name,shape)]
+    return column_names
+
+def get_field_components(column_prefix,field_name,shape):
+    # Returns the (column name, component index) of each column of a field of shape (N,...), where the column is field[:,*component]
+    field_type = get_field_type(field_name,shape)
+
+    # Scalars can be added directly
+    if field_type == 'scalar':
+        return [(column_prefix,())]
+
+    # Vectors and matrices should be added one component at a time
+    if field_type == 'vector':
+        return [(column_prefix+'_'+str(i+1),(i,)) for i in range(shape[1])]
+
+    if field_type == 'matrix':
+        return [(column_prefix+'_'+str(i+1)+str(j+1),(i,j)) for i in range(3) for j in range(3)]
+
+    if field_type == 'symm_matrix':
+        return [(column_prefix+'_'+str(i+1)+str(j+1),(i,j)) for i, j in SYMM_COMPONENTS]
+
+    # The Tensor basis field requires special handling, since it is of shape [N,10,3,3]
+    if field_type == 'tensor_basis':
+        return [(column_prefix+'_'+str(n+1)+'_'+str(i+1)+str(j+1),(n,i,j)) for n in range(10) for i, j in SYMM_COMPONENTS]
+    return []
+
+def get_field_type(fieldname,shape):
+    # Determine field type based on the number of dimensions of the field shape, and for symmetric matrices, the fieldname itself.
+    ndims = len(shape)
+    fieldtype = None
     if ndims == 1:
         fieldtype = 'scalar'
     if ndims == 2: 
@@ -127,13 +171,7 @@ def get_field_type(fieldname,field):
             fieldtype = 'symm_matrix'
         else: 
             fieldtype = 'matrix'
-    if ndims == 4 and field.shape[1]==10:
+    if ndims == 4 and shape[1]==10:
         fieldtype = 'tensor_basis'
 
     return fieldtype
-
-def add_data(dataframe_case,field_dir,field_name,field):
-    # Expects field to be a 1D scalar
-    # Usually throws performance warnings after several calls, but performance is usually acceptable.
-    dataframe_case[field_dir+'_'+field_name] = field.tolist()
-    return dataframe_case
\ No newline at end of file
@@ -3,26 +3,88 @@
 
 import os
 import numpy as np
-from sklearn.metrics import r2_score
-from sklearn.linear_model import LinearRegression
-from sklearn.linear_model import Ridge
-import multiprocessing as mp
+
+# Independent components of a symmetric 3x3 tensor (xx, xy, xz, yy, yz, zz) in the flattened tensor
+SYMM_TENSOR_COMPONENTS = [0,1,2,4,5,8]
+# Singular values below PINV_RCOND times the largest are ignored in the minimum-norm basis coefficient fit (the basis is degenerate in 2D flows)
+PINV_RCOND = 1E-10
+# Cells solved at a time in calc_tensor_basis_coefficients
+FIT_CHUNK_CELLS = 100000
+
+def get_r2(y,y_pred):
+    # r2 of each row of y (N x K), as sklearn.metrics.r2_score: 1 for a perfect fit and 0 otherwise when the row of y is constant
+    ss_res = np.sum((y - y_pred)**2,axis=1)
+    ss_tot = np.sum((y - y.mean(axis=1)[:,None])**2,axis=1)
+    return np.where(ss_tot > 0,1 - ss_res/np.where(ss_tot > 0,ss_tot,1),np.where(ss_res == 0,1.0,0.0))
 
 def nnls_fit(S,a):
-    """Calculates the non-negative least-squares fit for a = -2*nut*S. 
-    Returns optimal nut, and the r2 value.
+    """Calculates the non-negative least-squares fit for a = -2*nut*S, using the 6 independent components of each tensor.
+    S, a: N x 3 x 3 arrays (or single 3 x 3 tensors). For one coefficient, the optimum is nut = max(0, <X,y>/<X,X>) with X = -2*S and y = a,
+    so all cells are fitted at once.
+    Returns optimal nut, and the r2 value (as sklearn.metrics.r2_score for each cell).
     """
-    X = -2*np.delete(S.reshape((1,9)),[3,6,7],axis=1).flatten().reshape(-1,1)
-    y = np.delete(a.reshape((1,9)),[3,6,7],axis=1).flatten().reshape(-1,1)  
-    reg_nnls = LinearRegression(positive=True,fit_intercept = False)
-    reg_nnls.fit(X, y)
-    nut_nnls = reg_nnls.coef_[0,0]
-    y_pred_nnls = reg_nnls.predict(X)
-    r2_nnls = r2_score(y, y_pred_nnls)
+    X = -2*np.reshape(S,(-1,9))[:,SYMM_TENSOR_COMPONENTS]
+    y = np.reshape(a,(-1,9))[:,SYMM_TENSOR_COMPONENTS]
+    XX = np.einsum('ij,ij->i',X,X)
+    Xy = np.einsum('ij,ij->i',X,y)
+    nut_nnls = np.zeros(len(X))
+    np.divide(Xy,XX,out=nut_nnls,where=XX > 0)
+    nut_nnls = np.maximum(nut_nnls,0)
+
+    r2_nnls = get_r2(y,nut_nnls[:,None]*X)
+    if np.ndim(S) == 2:
+        return nut_nnls[0], r2_nnls[0]
     return nut_nnls, r2_nnls
 
+def solve_basis_coefficients(A,y,ridge=0.0):
+    # Least-squares solution of A g = y for a stack of systems (A: N x 6 x n, y: N x 6). Minimum-norm (pseudo-inverse) solution
+    # for ridge = 0, otherwise the normal equations (A^T A + ridge I) g = A^T y.
+    if ridge > 0:
+        AT = A.transpose(0,2,1)
+        return np.linalg.solve(AT @ A + ridge*np.eye(A.shape[2]),(AT @ y[:,:,None]))[:,:,0]
+    return (np.linalg.pinv(A,rcond=PINV_RCOND) @ y[:,:,None])[:,:,0]
+
+def tensor_basis_fit(T,y,ridge=0.0,nonnegative_g1=True):
+    """Calculates the optimal coefficients g of y = sum_n g_n T_n in each cell, using the 6 independent components of each tensor.
+    T: N x n_basis x 3 x 3 basis tensors (e.g. T1-T10), y: N x 3 x 3 target (e.g. b or a).
+    All cells are solved at once as a stack of 6 x n_basis systems (see solve_basis_coefficients), with optional ridge regularisation.
+    nonnegative_g1: cells where the fitted g1 is negative are refitted with g1 = 0, so that the T1 (eddy viscosity) term is never anti-diffusive.
+    Returns g (N x n_basis), and the r2 value of each cell.
+    """
+    A = np.reshape(T,(len(T),T.shape[1],9))[:,:,SYMM_TENSOR_COMPONENTS].transpose(0,2,1)
+    y = np.reshape(y,(-1,9))[:,SYMM_TENSOR_COMPONENTS]
+    g = solve_basis_coefficients(A,y,ridge)
+    if nonnegative_g1:
+        negative = g[:,0] < 0
+        if negative.any():
+            g[negative,0] = 0
+            g[negative,1:] = solve_basis_coefficients(A[negative,:,1:],y[negative],ridge)
+    return g, get_r2(y,np.einsum('ijk,ik->ij',A,g))
+
+def calc_tensor_basis_coefficients(ref_field_dir,ref_case_prefix_and_name,coarse_field_dir,coarse_case_prefix_and_name,
+                                   target='b',n_basis=10,ridge=0.0,nonnegative_g1=True,chunk_cells=FIT_CHUNK_CELLS,LES_case=True):
+    """Calculates the optimal tensor basis coefficients g1..g{n_basis} that project the reference target (b or a) onto the basis tensors
+    T1..T{n_basis} of the coarse (RANS) case, in each cell (see tensor_basis_fit). The reference fields must be on the coarse mesh (e.g. after map_coarse_fine).
+    target: 'b' or 'a' (loaded as {target}Mean for LES cases).
+    Cells are processed chunk_cells at a time from memory-mapped inputs, and g is written to {ref_case_prefix_and_name}_g_lsq.npy (N x n_basis)
+    and the r2 values to {ref_case_prefix_and_name}_r2_g_lsq.npy.
+    """
+    y = np.load(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_'+target+('Mean' if LES_case else '')+'.npy'),mmap_mode='r')
+    T = [np.load(os.path.join(coarse_field_dir,coarse_case_prefix_and_name+f'_T{n+1}.npy'),mmap_mode='r') for n in range(n_basis)]
+    print('[dataFoam] Calculating tensor basis coefficients g1-g'+str(n_basis)+' of '+target+' for '+ref_case_prefix_and_name+' in '+ref_field_dir)
+    g = np.lib.format.open_memmap(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_g_lsq.npy'),mode='w+',shape=(len(y),n_basis))
+    r2 = np.lib.format.open_memmap(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_r2_g_lsq.npy'),mode='w+',shape=(len(y),))
+    for start in range(0,len(y),chunk_cells):
+        end = min(start+chunk_cells,len(y))
+        g[start:end], r2[start:end] = tensor_basis_fit(np.stack([Tn[start:end] for Tn in T],axis=1),y[start:end],ridge,nonnegative_g1)
+    print(f'[dataFoam] Mean r2 of the tensor basis fit: {np.mean(r2):.4f}')
+    g.flush()
+    r2.flush()
+    return
+
 def calc_nnls_nut_aperp(ref_field_dir,ref_case_prefix_and_name,parallel=True,LES_case=True):
-    """Calls nnls_fit in parallel if needed, and also calculates aperp.
+    """Calculates the nnls nut for every cell (see nnls_fit), and also calculates aperp.
+    parallel: not needed anymore, since the fit is vectorized over all cells. Kept so that existing calls still work.
     ref: https://doi.org/10.1063/5.0083074
     """
     if LES_case:
@@ -32,25 +94,10 @@ def calc_nnls_nut_aperp(ref_field_dir,ref_case_prefix_and_name,parallel=True,LES
         S = np.load(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_S.npy'))
         a = np.load(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_a.npy'))
 
-    nut_nnls = np.empty(len(S))
-    r2_nnls = np.empty(len(S))
-
     print('[dataFoam] Calculating nnls nut, aperp for '+ref_case_prefix_and_name+ ' in '+ref_field_dir)
-    if parallel:
-        ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
-        print(f'Parallel ncpus {ncpus}')
-        pool = mp.Pool(processes=ncpus)
-        results = pool.starmap(nnls_fit, [(Si,ai) for Si, ai in zip(S,a)])
-        nut_nnls = np.array([result[0] for result in results])
-        r2_nnls = np.array([result[1] for result in results])
-
-    else:
-        for i in range(len(S)):
-            nut_nnls, r2_nnls = nnls_fit(S[i],a[i])
-            if i % 10000 == 0:
-                print('[dataFoam] Point: '+str(i)+'/'+str(len(S)))
+    nut_nnls, r2_nnls = nnls_fit(S,a)
 
-    aperp_nnls = a + 2*np.repeat(nut_nnls,9).reshape(len(nut_nnls),3,3)*S  #a = -2*nut*S + aperp
+    aperp_nnls = a + 2*nut_nnls[:,None,None]*S  #a = -2*nut*S + aperp
     np.save(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_nut_nnls.npy'),nut_nnls)
     np.save(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_aperp_nnls.npy'),aperp_nnls)
     np.save(os.path.join(ref_field_dir,ref_case_prefix_and_name+'_r2_nnls.npy'),r2_nnls)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy versions of the extra RANS fields written by foam_applications/writeFields_RANS (Shat, Rhat, the basis tensors T1-T10,
+the invariants lambda1-5, I1_1-I1_47, I2_1-I2_47, and q1-q9), computed for all cells at once from the fields saved by saveDataset
+with the lean komegasst field list (gradU, k, omega or epsilon, nut, wallDistance, gradk, gradomega).
+"""
+import os
+import re
+import time
+import numpy as np
+
+# Small numbers from writeFields_RANS: SMALL_S2 (q1) and small_kdims (q7)
+SMALL_S2 = 1E-30
+SMALL_KDIMS = 0.5E-10
+# Cells calculated at a time in save_rans_features
+FEATURE_CHUNK_CELLS = 20000
+
+# Integrity basis tensors B1-B47 from Wu 2018 (https://doi.org/10.1103/PhysRevFluids.3.074602), as in writeFields_RANS.
+# Each letter is a factor of the product: S = Shat, R = Rhat, O = Aohat, K = Akhat.
+INTEGRITY_BASIS = ['SS', 'SSS', 'RR', 'OO', 'KK', 'RRS', 'RRSS', 'RRSRSS', 'OOS', 'OOSS',
+                   'OOSOSS', 'KKS', 'KKSS', 'KKSKSS', 'RO', 'OK', 'RK', 'ROS', 'ROSS', 'RROS',
+                   'OORS', 'RROSS', 'OORSS', 'RRSOSS', 'OOSRSS', 'RKS', 'RKSS', 'RRKS', 'KKRS', 'RRKSS',
+                   'KKRSS', 'RRSKSS', 'KKSRSS', 'OKS', 'OKSS', 'OOKS', 'KKOS', 'OOKSS', 'KKOSS', 'OOSKSS',
+                   'KKSOSS', 'ROK', 'ROKS', 'RKOS', 'ROKSS', 'RKOSS', 'ROSKSS']
+
+def trace(A):
+    return np.trace(A,axis1=-2,axis2=-1)
+
+def calc_S_R(gradU):
+    # Mean strain and rotation rate tensors from the velocity gradient (the Jacobian, dU_i/dx_j, as saved by saveDataset)
+    S = 0.5*(gradU + gradU.transpose(0,2,1))
+    R = 0.5*(gradU - gradU.transpose(0,2,1))
+    return S, R
+
+def calc_antisymmetric_tensor(gradient):
+    # Antisymmetric tensor associated with a gradient vector (Ao from gradomega, Ak from gradk in writeFields_RANS)
+    A = np.zeros((len(gradient),3,3))
+    A[:,0,1], A[:,0,2] = -gradient[:,2], gradient[:,1]
+    A[:,1,0], A[:,1,2] = gradient[:,2], -gradient[:,0]
+    A[:,2,0], A[:,2,1] = -gradient[:,1], gradient[:,0]
+    return A
+
+def calc_basis_tensors(Shat,Rhat):
+    """Basis tensors T1-T10 from Pope 1975, J. Fluid Mech. (1975), vol. 72, part 2, pp. 331-340. Returns a list of 10 N x 3 x 3 arrays."""
+    I = np.identity(3)
+    SS = Shat @ Shat
+    RR = Rhat @ Rhat
+    SR = Shat @ Rhat
+    RS = Rhat @ Shat
+    RSS = RS @ Shat
+    SSR = SS @ Rhat
+    RRS = RR @ Shat
+    SRR = SR @ Rhat
+    SSRR = SS @ RR
+    return [Shat,
+            SR - RS,
+            SS - 1/3*trace(SS)[:,None,None]*I,
+            RR - 1/3*trace(RR)[:,None,None]*I,
+            RSS - SSR,
+            RRS + SRR - 2/3*trace(SRR)[:,None,None]*I,
+            RS @ RR - RR @ Shat @ Rhat,
+            SR @ SS - SS @ Rhat @ Shat,
+            RR @ SS + SSRR - 2/3*trace(SSRR)[:,None,None]*I,
+            RSS @ RR - RR @ SS @ Rhat]
+
+def calc_lambdas(Shat,Rhat):
+    """Invariants lambda1-lambda5 from Pope 1975. Returns a list of 5 arrays of length N."""
+    SS = Shat @ Shat
+    RR = Rhat @ Rhat
+    return [trace(SS), trace(RR), trace(SS @ Shat), trace(RR @ Shat), trace(RR @ SS)]
+
+def calc_integrity_basis_invariants(Shat,Rhat,Aohat,Akhat,basis=INTEGRITY_BASIS):
+    """Invariants I1_n = tr(Bn) and I2_n = 0.5*(tr(Bn)^2 - tr(Bn Bn)) of the integrity basis tensors (see INTEGRITY_BASIS).
+    Products shared by several basis tensors (e.g. RRS in B6, B7, B8) are computed once. Returns I1, I2 as N x len(basis) arrays.
+    """
+    factors = {'S': Shat, 'R': Rhat, 'O': Aohat, 'K': Akhat}
+    products = dict(factors)
+    # Index of the last basis tensor using each product, after which it is dropped
+    last_use = {product[:length]: n for n, product in enumerate(basis) for length in range(2,len(product)+1)}
+    I1 = np.empty((len(Shat),len(basis)))
+    I2 = np.empty((len(Shat),len(basis)))
+    for n, product in enumerate(basis):
+        for length in range(2,len(product)+1):
+            if product[:length] not in products:
+                products[product[:length]] = products[product[:length-1]] @ factors[product[length-1]]
+        B = products[product]
+        I1[:,n] = trace(B)
+        I2[:,n] = 0.5*(I1[:,n]**2 - np.einsum('nij,nji->n',B,B))
+        for prefix in [prefix for prefix in products if last_use.get(prefix) == n]:
+            del products[prefix]
+    return I1, I2
+
+def calc_rans_features(gradU,k,nut,nu,omega=None,epsilon=None,wallDistance=None,gradk=None,gradomega=None,U=None):
+    """Calculates the extra fields of writeFields_RANS for all cells. Returns a dict of {field name: array}, using the writeFields_RANS field names.
+    gradU: N x 3 x 3 velocity gradient (Jacobian), k, nut: N, nu: kinematic viscosity.
+    omega or epsilon: N (epsilon = 0.09*k*omega, as in writeFields_RANS).
+    The integrity basis invariants need gradk and gradomega, q2, q5-q9 need wallDistance, and DUDt needs U. Fields whose inputs are missing are not calculated.
+    """
+    if omega is None and epsilon is None:
+        raise ValueError('[dataFoam] calc_rans_features requires omega or epsilon')
+    if epsilon is None:
+        epsilon = 0.09*k*omega
+    if omega is None:
+        omega = epsilon/(0.09*k)
+    fields = {'epsilon': epsilon,
+              'T_t_ke': k/epsilon,
+              'T_t_nut': nut/k,
+              'T_k': np.sqrt(nu/epsilon),
+              'C_Ak': nut/(np.sqrt(k)*k),
+              'C_Ao': nut/(np.sqrt(k)*omega)}
+
+    S, R = calc_S_R(gradU)
+    Shat = fields['T_t_nut'][:,None,None]*S
+    Rhat = fields['T_t_nut'][:,None,None]*R
+    fields.update({'S': S, 'R': R, 'Shat': Shat, 'Rhat': Rhat})
+    fields.update({f'T{n+1}': T for n, T in enumerate(calc_basis_tensors(Shat,Rhat))})
+    fields.update({f'lambda{n+1}': invariant for n, invariant in enumerate(calc_lambdas(Shat,Rhat))})
+
+    if gradk is not None and gradomega is not None:
+        fields['Ao'] = calc_antisymmetric_tensor(gradomega)
+        fields['Ak'] = calc_antisymmetric_tensor(gradk)
+        fields['Aohat'] = fields['C_Ao'][:,None,None]*fields['Ao']
+        fields['Akhat'] = fields['C_Ak'][:,None,None]*fields['Ak']
+        I1, I2 = calc_integrity_basis_invariants(Shat,Rhat,fields['Aohat'],fields['Akhat'])
+        fields.update({f'I1_{n+1}': I1[:,n] for n in range(len(INTEGRITY_BASIS))})
+        fields.update({f'I2_{n+1}': I2[:,n] for n in range(len(INTEGRITY_BASIS))})
+
+    # Some q's from ref Kaandorp 2020, 10.1016/j.compfluid.2020.104497
+    magS2 = np.sum(S**2,axis=(1,2))
+    magR2 = np.sum(R**2,axis=(1,2))
+    fields['q1'] = 0.5*(magR2 - magS2)/np.maximum(magS2,SMALL_S2)
+    fields['q3'] = fields['T_t_ke']*np.sqrt(magS2)
+    fields['turbR'] = 2/3*k[:,None,None]*np.identity(3) - nut[:,None,None]*(2*S - 2/3*trace(S)[:,None,None]*np.identity(3))
+    fields['q4'] = np.sqrt(np.sum(fields['turbR']**2,axis=(1,2)))/k
+    if wallDistance is not None:
+        fields['q2'] = np.minimum(np.sqrt(k)*wallDistance/(50.0*nu),2.0)
+        # Other q's from the komegasst model
+        fields['q5'] = np.sqrt(k)/(0.09*omega*wallDistance)
+        fields['q6'] = 500.0*nu/(wallDistance**2*omega)
+        if gradk is not None and gradomega is not None:
+            fields['q7'] = 2.0*k/np.maximum(wallDistance**2/omega*np.einsum('ni,ni->n',gradk,gradomega),SMALL_KDIMS)
+            fields['q8'] = np.minimum(np.maximum(fields['q5'],fields['q6']),fields['q7'])
+            fields['q9'] = np.tanh(fields['q8']**4)
+    if U is not None:
+        fields['DUDt'] = np.einsum('nj,nij->ni',U,gradU)
+    return fields
+
+def read_nu(foam_case_dir):
+    # Reads the kinematic viscosity nu from constant/transportProperties (either "nu 1e-05;" or "nu nu [0 2 -1 0 0 0 0] 1e-05;")
+    with open(os.path.join(foam_case_dir,'constant','transportProperties')) as file:
+        content = re.sub(r'//.*','',file.read())
+    match = re.search(r'^\s*nu\s+(?:nu\s+)?(?:\[[^\]]*\]\s*)?([-+0-9.eE]+)\s*;',content,re.M)
+    if match is None:
+        raise LookupError('[dataFoam] nu not found in '+os.path.join(foam_case_dir,'constant','transportProperties'))
+    return float(match.group(1))
+
+def save_rans_features(data_save_path,dataset_prefix,nu,fields_list=None,chunk_cells=FEATURE_CHUNK_CELLS):
+    """Loads the fields saved by saveDataset ({dataset_prefix}_gradU.npy, _k, _nut, _omega or _epsilon, and if present _wallDistance, _gradk, _gradomega, _U),
+    calculates the extra RANS fields with calc_rans_features, and saves them as {dataset_prefix}_{field}.npy.
+    nu: kinematic viscosity, or a foam case directory to read it from (see read_nu).
+    fields_list: fields to save (default: every calculated field that was not an input). Inputs cannot be saved, and every field must be calculable from the inputs.
+    Cells are processed chunk_cells at a time from memory-mapped inputs into preallocated memory-mapped outputs,
+    so the memory used depends on chunk_cells and not on the number of cells.
+    """
+    if isinstance(nu,str):
+        nu = read_nu(nu)
+    get_file = lambda field: os.path.join(data_save_path,dataset_prefix+'_'+field+'.npy')
+    inputs = {field: np.load(get_file(field),mmap_mode='r') if os.path.exists(get_file(field)) else None
+              for field in ['gradU','k','nut','omega','epsilon','wallDistance','gradk','gradomega','U']}
+    if inputs['omega'] is not None:
+        # epsilon is calculated from omega, so a saved epsilon is the output of a previous run
+        inputs['epsilon'] = None
+    if fields_list is not None and any(inputs.get(field) is not None for field in fields_list):
+        # Opening an output would truncate the memory-mapped input of the same name
+        raise ValueError('[dataFoam] Cannot save '+str([field for field in fields_list if inputs.get(field) is not None])+', which are inputs of save_rans_features')
+    n_cells = len(inputs['gradU'])
+    print('[dataFoam] Calculating RANS features for '+dataset_prefix+' from '+', '.join(field for field, value in inputs.items() if value is not None)
+          +f', {chunk_cells} cells at a time')
+    start_time = time.perf_counter()
+    outputs = None
+    for start in range(0,n_cells,chunk_cells):
+        end = min(start+chunk_cells,n_cells)
+        fields = calc_rans_features(nu=nu,**{field: None if value is None else np.asarray(value[start:end]) for field, value in inputs.items()})
+        if outputs is None:
+            if fields_list is None:
+                fields_list = [field for field in fields if inputs.get(field) is None]
+            missing = [field for field in fields_list if field not in fields]
+            if missing:
+                raise ValueError(f'[dataFoam] {missing} cannot be calculated from the fields saved for {dataset_prefix} (see calc_rans_features for the inputs each field needs)')
+            outputs = {field: np.lib.format.open_memmap(get_file(field),mode='w+',dtype=fields[field].dtype,shape=(n_cells,)+fields[field].shape[1:])
+                       for field in fields_list}
+        for field in fields_list:
+            outputs[field][start:end] = fields[field]
+    for output in (outputs or {}).values():
+        output.flush()
+    print(f'[dataFoam] Saved {len(fields_list or [])} RANS features to {data_save_path} ({time.perf_counter()-start_time:.2f} s)')
+    return
@@ -2,8 +2,324 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import hashlib
+import itertools
 import numpy as np
+import scipy.sparse
+from scipy.spatial import Delaunay, cKDTree
 from scipy.interpolate import griddata
+from concurrent.futures import ProcessPoolExecutor
+from dataFoam.utilities.extractionManifest import get_file_hash
+
+# Methods for which FineCoarseMapper precomputes interpolation weights. Other griddata methods (cubic) are interpolated field by field.
+MAPPER_METHODS = ['linear', 'nearest', 'volume_average']
+# Default size limit of a weights cache directory, in bytes. The least recently used weights are deleted above this size.
+WEIGHTS_CACHE_SIZE = 2E9
+# Fine points read at a time when assigning fine points to tiles
+TILE_CHUNK_ROWS = 1000000
+
+class FineCoarseMapper:
+    """
+    Interpolation from fine points C_fine onto coarse points C_coarse, with the same results as scipy.interpolate.griddata
+    (linear or nearest), and nearest for coarse points outside the convex hull of C_fine (where linear gives NaN).
+    The Delaunay triangulation/KD-tree is built once, and the simplex vertices and barycentric weights are stored
+    as a sparse (n_coarse x n_fine) matrix, so each mapped field only costs a sparse matrix product:
+        mapper = FineCoarseMapper(C_fine, C_coarse, 'linear')
+        U_coarse = mapper.map(U_fine)
+        U_coarse, tau_coarse = mapper.map_fields([U_fine, tau_fine])
+    Fine rows with a NaN in any component of a field are left out of the interpolation of that field, by renormalising
+    the weights of the remaining fine points, so every component of a coarse row uses the same weights.
+    The volume_average method is a conservative cell average instead of a point interpolation: each fine cell is binned into
+    the coarse cell with the nearest centre, and each coarse value is the volume-weighted mean of its fine cells (V_fine: fine cell volumes).
+    Coarse cells containing no fine cell take the nearest fine value.
+    """
+
+    def __init__(self,C_fine,C_coarse,method='linear',V_fine=None):
+        if method not in MAPPER_METHODS:
+            raise ValueError('[dataFoam] FineCoarseMapper method must be one of '+str(MAPPER_METHODS)+', not '+str(method))
+        if method == 'volume_average' and V_fine is None:
+            raise ValueError('[dataFoam] FineCoarseMapper method volume_average requires the fine cell volumes V_fine')
+        self.method = method
+        self.weights, self.n_outside = self.build_weights(np.asarray(C_fine,dtype=float),np.asarray(C_coarse,dtype=float),V_fine)
+
+    def build_weights(self,C_fine,C_coarse,V_fine=None):
+        # Returns the sparse weight matrix, and the number of coarse points filled with nearest (outside the convex hull,
+        # or containing no fine cell for volume_average).
+        rows = np.arange(len(C_coarse))
+        if self.method == 'volume_average':
+            # Fine cells are binned into coarse cells with a KD-tree on the coarse centres, and their volumes summed with one bincount
+            V_fine = np.asarray(V_fine,dtype=float)
+            coarse_cells = cKDTree(C_coarse).query(C_fine)[1]
+            coarse_volumes = np.bincount(coarse_cells,weights=V_fine,minlength=len(C_coarse))
+            empty = np.flatnonzero(coarse_volumes == 0)
+            nearest = cKDTree(C_fine).query(C_coarse[empty])[1] if len(empty) > 0 else np.zeros(0,dtype=int)
+            weights = np.concatenate([V_fine/coarse_volumes[coarse_cells],np.ones(len(empty))])
+            return scipy.sparse.csr_matrix((weights,(np.concatenate([coarse_cells,empty]),np.concatenate([np.arange(len(C_fine)),nearest]))),
+                                           shape=(len(C_coarse),len(C_fine))), len(empty)
+
+        if self.method == 'nearest':
+            columns = cKDTree(C_fine).query(C_coarse)[1]
+            return scipy.sparse.csr_matrix((np.ones(len(C_coarse)),(rows,columns)),shape=(len(C_coarse),len(C_fine))), 0
+
+        triangulation = Delaunay(C_fine)
+        ndim = C_fine.shape[1]
+        simplex = triangulation.find_simplex(C_coarse)
+        outside = simplex < 0
+        # Barycentric coordinates, as in scipy's LinearNDInterpolator
+        transform = triangulation.transform[simplex]
+        barycentric = np.einsum('ijk,ik->ij',transform[:,:ndim],C_coarse-transform[:,ndim])
+        weights = np.column_stack([barycentric,1-barycentric.sum(axis=1)])
+        columns = triangulation.simplices[simplex]
+        # Coarse points outside the convex hull get a single nearest weight
+        weights[outside] = np.eye(1,ndim+1)
+        if np.any(outside):
+            columns[outside] = cKDTree(C_fine).query(C_coarse[outside])[1][:,None]
+        return scipy.sparse.csr_matrix((weights.ravel(),(np.repeat(rows,ndim+1),columns.ravel())),shape=(len(C_coarse),len(C_fine))), int(outside.sum())
+
+    @property
+    def n_fine(self):
+        return self.weights.shape[1]
+
+    @property
+    def n_coarse(self):
+        return self.weights.shape[0]
+
+    def save(self,weights_file):
+        # Saves the interpolation weights to a .npz file, which can be loaded with FineCoarseMapper.load.
+        np.savez(weights_file,data=self.weights.data,indices=self.weights.indices,indptr=self.weights.indptr,
+                 shape=self.weights.shape,n_outside=self.n_outside,method=self.method)
+
+    @classmethod
+    def load(cls,weights_file):
+        # Returns a mapper with the weights saved in weights_file, without any triangulation.
+        with np.load(weights_file) as saved:
+            mapper = cls.__new__(cls)
+            mapper.method = str(saved['method'])
+            mapper.n_outside = int(saved['n_outside'])
+            mapper.weights = scipy.sparse.csr_matrix((saved['data'],saved['indices'],saved['indptr']),shape=tuple(saved['shape']))
+        return mapper
+
+    def map(self,field_fine):
+        # Interpolates a fine field with any number of components (N, N x 3, N x 3 x 3, ...) onto the coarse points.
+        return self.map_fields([field_fine])[0]
+
+    def map_fields(self,fields_fine):
+        # Interpolates a list of fine fields. The trailing dimensions of each field are flattened into one N x K array,
+        # so that every component is interpolated in a single sparse product, and then reshaped back to the field's shape.
+        # (Stacking several fields into one product is slower, since the copy into the stacked array costs more than the product.)
+        fields_coarse = []
+        for field_fine in fields_fine:
+            field_fine = np.asarray(field_fine)
+            if len(field_fine) != self.n_fine:
+                raise ValueError(f'[dataFoam] Field has {len(field_fine)} values, but the mapper was built for {self.n_fine} fine points')
+            field_columns = field_fine.reshape(self.n_fine,-1)
+            fine_nan_rows = np.isnan(field_columns).any(axis=1)
+            if fine_nan_rows.any():
+                field_coarse = self.map_valid_rows(field_columns,~fine_nan_rows)
+            else:
+                field_coarse = self.weights @ field_columns
+            fields_coarse.append(field_coarse.reshape((self.n_coarse,)+field_fine.shape[1:]))
+        return fields_coarse
+
+    def map_valid_rows(self,field_fine,valid_rows):
+        # Interpolates an N x K fine field using only the fine rows in valid_rows, with the weights of each coarse row renormalised.
+        # Coarse rows with no valid fine point among their weights are NaN.
+        print('[dataFoam] Fine field has '+str(len(valid_rows)-valid_rows.sum())+' rows with nans, interpolating from the remaining rows')
+        valid_weights = self.weights @ valid_rows.astype(float)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            field_coarse = (self.weights @ np.where(valid_rows[:,None],field_fine,0))/valid_weights[:,None]
+        field_coarse[valid_weights == 0] = np.nan
+        if (valid_weights == 0).any():
+            print('[dataFoam] '+str((valid_weights == 0).sum())+' coarse rows have no valid fine point, and are set to nan')
+        return field_coarse
+
+def get_weights_cache_file(weights_cache_dir,fine_C_file,coarse_C_file,method,coordinates,fine_V_file=None):
+    # Cache file for the weights between two meshes, keyed by the contents of both _C.npy files, the method,
+    # and the coordinates used (e.g. 'xy', or 'yz' for the DUCT cases).
+    # volume_average weights also depend on the fine cell volumes, so the contents of fine_V_file are part of its key.
+    key = '_'.join([get_file_hash(fine_C_file),get_file_hash(coarse_C_file),method,coordinates]
+                   +([get_file_hash(fine_V_file)] if method == 'volume_average' else []))
+    return os.path.join(weights_cache_dir,'weights_'+hashlib.blake2b(key.encode(),digest_size=16).hexdigest()+'.npz')
+
+def evict_weights_cache(weights_cache_dir,weights_cache_size=WEIGHTS_CACHE_SIZE,keep=None):
+    # Deletes the least recently used weights files until the cache is below weights_cache_size bytes (never deleting keep).
+    files = [os.path.join(weights_cache_dir,file) for file in os.listdir(weights_cache_dir) if file.startswith('weights_') and file.endswith('.npz')]
+    files.sort(key=os.path.getmtime)
+    total_size = sum(os.path.getsize(file) for file in files)
+    for file in files:
+        if total_size <= weights_cache_size:
+            break
+        if file != keep:
+            total_size -= os.path.getsize(file)
+            os.remove(file)
+            print('[dataFoam] Removed '+file+' from the weights cache')
+
+def get_mapper(C_fine,C_coarse,interp_method,weights_cache_file=None,weights_cache_size=WEIGHTS_CACHE_SIZE,V_fine=None):
+    # Returns a FineCoarseMapper, loaded from weights_cache_file if it exists, or computed (and saved to weights_cache_file).
+    if weights_cache_file is not None and os.path.exists(weights_cache_file):
+        start_time = time.perf_counter()
+        mapper = FineCoarseMapper.load(weights_cache_file)
+        if mapper.n_fine == len(C_fine) and mapper.n_coarse == len(C_coarse):
+            os.utime(weights_cache_file)
+            print(f'[dataFoam] Loaded {interp_method} interpolation weights from {weights_cache_file} in {time.perf_counter()-start_time:.3f} s')
+            return mapper
+    start_time = time.perf_counter()
+    mapper = FineCoarseMapper(C_fine,C_coarse,interp_method,V_fine)
+    print(f'[dataFoam] Computed {interp_method} interpolation weights in {time.perf_counter()-start_time:.2f} s')
+    if weights_cache_file is not None:
+        os.makedirs(os.path.dirname(weights_cache_file),exist_ok=True)
+        mapper.save(weights_cache_file)
+        print('[dataFoam] Saved interpolation weights to '+weights_cache_file)
+        evict_weights_cache(os.path.dirname(weights_cache_file),weights_cache_size,keep=weights_cache_file)
+    return mapper
+
+def interpolate_field_griddata(C_fine,field_fine,C_coarse,interp_method):
+    # Interpolates one field with scipy.interpolate.griddata, with all components of the field (flattened to N x K) in one call
+    field_columns = field_fine.reshape(len(field_fine),-1)
+    interp_field = griddata(C_fine,
+                            field_columns,
+                            C_coarse,
+                            method=interp_method)
+    # Below code fills rows containing NaNs with nearest (all components of the row), and prints info about how many NaNs were found
+    if interp_method != 'nearest':
+        nan_rows = np.isnan(interp_field).any(axis=1)
+        if nan_rows.any():
+            print('[dataFoam] Interpolation found '+ str(nan_rows.sum())+' rows with nans, using nearest to fill these rows in')
+            interp_field[nan_rows] = griddata(C_fine,
+                                              field_columns,
+                                              C_coarse[nan_rows], method='nearest')
+    return interp_field.reshape((len(C_coarse),)+field_fine.shape[1:])
+
+def map_fields_fine_coarse(C_fine,C_coarse,fine_field_dir,output_dir,fine_case_prefix_and_name,output_case_prefix_and_name,fields_list,interp_method,
+                           weights_cache_file=None,weights_cache_size=WEIGHTS_CACHE_SIZE,V_fine=None):
+    # Interpolates and saves each field in fields_list, using one FineCoarseMapper for all fields where possible. Returns the mapper (or None).
+    mapper = None
+    if interp_method in MAPPER_METHODS:
+        mapper = get_mapper(C_fine,C_coarse,interp_method,weights_cache_file,weights_cache_size,V_fine)
+        if mapper.n_outside > 0 and interp_method == 'volume_average':
+            print('[dataFoam] '+str(mapper.n_outside)+' coarse cells contain no fine cell, using nearest for these cells')
+        elif mapper.n_outside > 0:
+            print('[dataFoam] '+str(mapper.n_outside)+' coarse points are outside the fine mesh, using nearest for these points')
+    for field_name in fields_list:
+        print('[dataFoam] Interpolating '+field_name + ' using method '+interp_method)
+        field_fine = np.load(os.path.join(fine_field_dir,fine_case_prefix_and_name+'_'+field_name+'.npy'))
+        if mapper is not None:
+            interp_field = mapper.map(field_fine)
+        else:
+            interp_field = interpolate_field_griddata(C_fine,field_fine,C_coarse,interp_method)
+        print('[dataFoam] Saving interpolated field to ' + str(os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy')))
+        np.save(os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy'),interp_field)
+    return mapper
+
+def iterate_fine_tiles(C_fine,lower,width,n_tiles,tile_halo,chunk_rows):
+    # Yields (tiles, fine indices) pairs covering every fine point once for each tile from the low to the high corner of its halo box.
+    # C_fine is read chunk_rows points at a time, so each pair has at most chunk_rows points.
+    ndim = len(lower)
+    get_tile_index = lambda points: np.floor((points-lower)/width).astype(np.int64)
+    for start in range(0,len(C_fine),chunk_rows):
+        points = np.asarray(C_fine[start:start+chunk_rows],dtype=float)
+        low, high = get_tile_index(points-tile_halo*width), get_tile_index(points+tile_halo*width)
+        in_tiles = ((high >= 0) & (low <= n_tiles-1)).all(axis=1)
+        low, high = np.clip(low[in_tiles],0,n_tiles-1), np.clip(high[in_tiles],0,n_tiles-1)
+        fine_index = start+np.flatnonzero(in_tiles)
+        for offset in itertools.product(range(int((high-low).max(initial=0))+1),repeat=ndim):
+            # Offsets past the high tile in any dimension are outside the halo box
+            inside = (low+offset <= high).all(axis=1)
+            yield np.ravel_multi_index(tuple((low[inside]+offset).T),(n_tiles,)*ndim), fine_index[inside]
+
+def get_tiles(C_fine,C_coarse,tile_points,tile_halo,fine_index_file,chunk_rows=TILE_CHUNK_ROWS):
+    # Splits the coarse points into a regular grid of tiles with about tile_points points each. Returns a list of (coarse indices, fine start, fine stop)
+    # for the non-empty tiles, where rows fine start:stop of the .npy fine_index_file are the fine indices of the tile plus a halo of tile_halo tile widths on each side.
+    # C_fine may be a memory-mapped array. It is read twice, chunk_rows points at a time: once to count the fine points of each tile,
+    # and once to write them into fine_index_file, so the memory used depends on chunk_rows and the number of tiles, not on the number of fine points.
+    if not tile_halo >= 0:
+        raise ValueError('[dataFoam] tile_halo must be a non-negative number of tile widths, not '+str(tile_halo))
+    ndim = C_coarse.shape[1]
+    lower = C_coarse.min(axis=0)
+    n_tiles = max(1,int(np.ceil((len(C_coarse)/tile_points)**(1/ndim))))
+    width = (C_coarse.max(axis=0)-lower)/n_tiles
+    width[width == 0] = 1
+    coarse_tiles = np.ravel_multi_index(tuple(np.clip(np.floor((C_coarse-lower)/width).astype(np.int64),0,n_tiles-1).T),(n_tiles,)*ndim)
+
+    fine_counts = np.zeros(n_tiles**ndim,dtype=np.int64)
+    for tiles, fine_index in iterate_fine_tiles(C_fine,lower,width,n_tiles,tile_halo,chunk_rows):
+        fine_counts += np.bincount(tiles,minlength=n_tiles**ndim)
+    fine_bounds = np.concatenate(([0],np.cumsum(fine_counts)))
+    # Each chunk's points are placed after the points already written to their tile
+    fine_tile_index = np.lib.format.open_memmap(fine_index_file,mode='w+',dtype=np.int64,shape=(int(fine_bounds[-1]),))
+    written = fine_bounds[:-1].copy()
+    for tiles, fine_index in iterate_fine_tiles(C_fine,lower,width,n_tiles,tile_halo,chunk_rows):
+        order = np.argsort(tiles,kind='stable')
+        tiles, fine_index = tiles[order], fine_index[order]
+        chunk_tiles, first, counts = np.unique(tiles,return_index=True,return_counts=True)
+        fine_tile_index[written[tiles]+np.arange(len(tiles))-np.repeat(first,counts)] = fine_index
+        written[chunk_tiles] += counts
+    fine_tile_index.flush()
+    del fine_tile_index
+
+    coarse_order = np.argsort(coarse_tiles,kind='stable')
+    coarse_bounds = np.searchsorted(coarse_tiles[coarse_order],np.arange(n_tiles**ndim+1))
+    return [(coarse_order[coarse_bounds[tile]:coarse_bounds[tile+1]],int(fine_bounds[tile]),int(fine_bounds[tile+1]))
+            for tile in range(n_tiles**ndim) if coarse_bounds[tile+1] > coarse_bounds[tile]]
+
+def map_tile(coarse_index,fine_start,fine_stop,fine_index_file,fine_C_file,coarse_C_file,columns,field_files,output_files,interp_method):
+    # Interpolates the fields onto the coarse points of one tile, from the fine points of the tile and its halo (rows fine_start:fine_stop of fine_index_file),
+    # and writes the result into the memory-mapped output files. Returns the number of coarse points filled with nearest.
+    # Sorted for locality in the memory-mapped fine data
+    fine_index = np.sort(np.load(fine_index_file,mmap_mode='r')[fine_start:fine_stop])
+    C_fine = np.load(fine_C_file,mmap_mode='r')[fine_index][:,columns]
+    C_coarse = np.load(coarse_C_file,mmap_mode='r')[coarse_index][:,columns]
+    if len(C_fine) <= C_fine.shape[1]:
+        raise ValueError(f'[dataFoam] A tile with {len(C_coarse)} coarse points has only {len(C_fine)} fine points in its halo, increase tile_halo or tile_points')
+    mapper = FineCoarseMapper(C_fine,C_coarse,interp_method)
+    for field_file, output_file in zip(field_files,output_files):
+        output = np.lib.format.open_memmap(output_file,mode='r+')
+        output[coarse_index] = mapper.map(np.load(field_file,mmap_mode='r')[fine_index])
+        output.flush()
+        del output
+    return mapper.n_outside
+
+def map_fields_fine_coarse_tiled(fine_C_file,coarse_C_file,columns,fine_field_dir,output_dir,fine_case_prefix_and_name,output_case_prefix_and_name,fields_list,interp_method,
+                                 tile_points,tile_halo=0.1,workers=1):
+    # Out-of-core version of map_fields_fine_coarse: the coarse points are split into tiles (see get_tiles), each tile is interpolated with its own
+    # FineCoarseMapper over only the fine points of the tile and its halo, and the results are written into memory-mapped .npy outputs.
+    # Fine coordinates and fields are only read through memory maps. Tiles are processed in parallel with workers processes.
+    if interp_method not in ['linear','nearest']:
+        raise ValueError('[dataFoam] Tiled interpolation requires interp_method linear or nearest, not '+str(interp_method))
+    start_time = time.perf_counter()
+    C_fine = np.load(fine_C_file,mmap_mode='r')[:,columns]
+    C_coarse = np.load(coarse_C_file)[:,columns]
+    # Fine indices of each tile, removed once every tile is interpolated
+    fine_index_file = os.path.join(output_dir,output_case_prefix_and_name+'_tiles_fine_index.npy')
+    tiles = get_tiles(C_fine,C_coarse,tile_points,tile_halo,fine_index_file)
+    print(f'[dataFoam] Split {len(C_coarse)} coarse points into {len(tiles)} tiles in {time.perf_counter()-start_time:.2f} s '
+          +f'(largest tile: {max(len(coarse) for coarse, _, _ in tiles)} coarse, {max(stop-start for _, start, stop in tiles)} fine points)')
+
+    field_files = [os.path.join(fine_field_dir,fine_case_prefix_and_name+'_'+field_name+'.npy') for field_name in fields_list]
+    output_files = [os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy') for field_name in fields_list]
+    # Outputs are created here, and each tile writes its own rows
+    for field_file, output_file in zip(field_files,output_files):
+        field_fine = np.load(field_file,mmap_mode='r')
+        output = np.lib.format.open_memmap(output_file,mode='w+',dtype=np.result_type(field_fine.dtype,float),shape=(len(C_coarse),)+field_fine.shape[1:])
+        del output
+
+    print('[dataFoam] Interpolating '+', '.join(fields_list)+' using method '+interp_method+' with '+str(workers)+' worker(s)')
+    tile_args = [list(args) for args in zip(*tiles)]
+    constant_args = [itertools.repeat(arg) for arg in [fine_index_file,fine_C_file,coarse_C_file,columns,field_files,output_files,interp_method]]
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                n_outside = sum(executor.map(map_tile,*tile_args,*constant_args))
+        else:
+            n_outside = sum(map(map_tile,*tile_args,*constant_args))
+    finally:
+        os.remove(fine_index_file)
+    if n_outside > 0:
+        print('[dataFoam] '+str(n_outside)+' coarse points are outside the fine points of their tile, using nearest for these points')
+    for output_file in output_files:
+        print('[dataFoam] Saved interpolated field to ' + output_file)
+    print(f'[dataFoam] Tiled interpolation took {time.perf_counter()-start_time:.2f} s')
 
 def interpolate_fields_fine_coarse(fine_field_dir,
                                           coarse_field_dir,
@@ -12,7 +328,12 @@ def interpolate_fields_fine_coarse(fine_field_dir,
                                           coarse_case_prefix_and_name,
                                           output_case_prefix_and_name,
                                           fields_list,
-                                          interp_method):
+                                          interp_method,
+                                          weights_cache_dir=None,
+                                          weights_cache_size=WEIGHTS_CACHE_SIZE,
+                                          tile_points=None,
+                                          tile_halo=0.1,
+                                          workers=1):
     """Interpolate an LES/DNS field onto a RANS field.
     *_field_dir: contains numpy files e.g. ..../DNS/ ofr ..../komegasst/
     output_dir: directory for saving interpolated fields
@@ -20,33 +341,40 @@ def interpolate_fields_fine_coarse(fine_field_dir,
     fields_list: list of DNS/LES fields to interpolate 
     interp_method: method used by scipy.interpolate.griddata. Suggested to use linear or nearest. The code will fill any NaNs with nearest.
     NaNs may be caused by asking certain interpolation methods to extrapolate.
+    interp_method can also be volume_average, the volume-weighted mean of the fine cells closest to each coarse cell centre, which requires
+    {fine_case_prefix_and_name}_V.npy. This is recommended when the fine mesh is much finer than the coarse mesh, where point interpolation aliases.
+    For linear and nearest, the interpolation weights are computed once and reused for every field (see FineCoarseMapper).
+    Returns the FineCoarseMapper, which can be reused to map further fields between the same meshes (None for other methods).
+    weights_cache_dir: optional directory where the weights are saved, keyed by the contents of both _C.npy files (and the fine _V.npy for volume_average) and the method,
+    so that later runs between the same meshes load the weights instead of recomputing them.
+    weights_cache_size: size limit of weights_cache_dir in bytes. The least recently used weights are deleted above this size.
+    tile_points: for very large fine meshes, interpolate tile by tile (linear or nearest only; volume_average never triangulates, and needs no tiles). The coarse points are split into a regular grid of tiles
+    with about tile_points coarse points each, and each tile is interpolated from the fine points within tile_halo tile widths of the tile,
+    so only one tile's triangulation is held in memory (per worker). Fine data is read through memory maps, and the outputs are written as memory maps.
+    The halo must be wide enough to contain the fine points around the edges of each tile. No mapper is returned, and the weights are not cached.
+    workers: number of processes interpolating tiles in parallel.
     """
 
     print('[dataFoam] Interpolating fields from '+fine_field_dir+' to '+coarse_field_dir)
-    C_fine = np.load(os.path.join(fine_field_dir,fine_case_prefix_and_name+'_C.npy'))[:,0:2]
-    C_coarse = np.load(os.path.join(coarse_field_dir,coarse_case_prefix_and_name+'_C.npy'))[:,0:2]
+    fine_C_file = os.path.join(fine_field_dir,fine_case_prefix_and_name+'_C.npy')
+    coarse_C_file = os.path.join(coarse_field_dir,coarse_case_prefix_and_name+'_C.npy')
+    C_fine = np.load(fine_C_file,mmap_mode='r')[:,0:2]
+    C_coarse = np.load(coarse_C_file,mmap_mode='r')[:,0:2]
+    fine_V_file = os.path.join(fine_field_dir,fine_case_prefix_and_name+'_V.npy')
+    V_fine = np.load(fine_V_file,mmap_mode='r') if interp_method == 'volume_average' else None
 
     print('[dataFoam] Fine field: '+fine_case_prefix_and_name+', '+str(len(C_fine))+ ' points')
     print('[dataFoam] Coarse field: '+coarse_case_prefix_and_name+', '+str(len(C_coarse))+ ' points')
 
-    for field_name in fields_list:
-        print('[dataFoam] Interpolating '+field_name + ' using method '+interp_method)
-        field_fine = np.load(os.path.join(fine_field_dir,fine_case_prefix_and_name+'_'+field_name+'.npy'))
-        interp_field = griddata(C_fine,
-                                field_fine,
-                                C_coarse,
-                                method=interp_method)
-        # Below code fills NaNs with nearest, and prints info about how many NaNs were found
-        if interp_method != 'nearest':
-            ind_nan = np.argwhere(np.isnan(interp_field))
-            if len(ind_nan) >0:
-                print('[dataFoam] Interpolation found '+ str(len(ind_nan))+' nans, using nearest to fill these nans in')
-            interp_field[ind_nan] = griddata(C_fine,
-                                             field_fine,
-                                             C_coarse[ind_nan], method='nearest')
-        print('[dataFoam] Saving interpolated field to ' + str(os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy')))
-        np.save(os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy'),interp_field)    
-    return    
+    if tile_points is not None:
+        return map_fields_fine_coarse_tiled(fine_C_file,coarse_C_file,slice(0,2),fine_field_dir,output_dir,fine_case_prefix_and_name,output_case_prefix_and_name,
+                                            fields_list,interp_method,tile_points,tile_halo,workers)
+
+    weights_cache_file = None
+    if weights_cache_dir is not None and interp_method in MAPPER_METHODS:
+        weights_cache_file = get_weights_cache_file(weights_cache_dir,fine_C_file,coarse_C_file,interp_method,'xy',fine_V_file)
+    return map_fields_fine_coarse(C_fine,C_coarse,fine_field_dir,output_dir,fine_case_prefix_and_name,output_case_prefix_and_name,fields_list,interp_method,
+                                  weights_cache_file,weights_cache_size,V_fine)
 
 def interpolate_fields_fine_coarse_DUCT(fine_field_dir,
                                           coarse_field_dir,
@@ -55,34 +383,35 @@ def interpolate_fields_fine_coarse_DUCT(fine_field_dir,
                                           coarse_case_prefix_and_name,
                                           output_case_prefix_and_name,
                                           fields_list,
-                                          interp_method):
+                                          interp_method,
+                                          weights_cache_dir=None,
+                                          weights_cache_size=WEIGHTS_CACHE_SIZE,
+                                          tile_points=None,
+                                          tile_halo=0.1,
+                                          workers=1):
     """
     Special version of interpolate_fields_fine_coarse for a duct case.
-    Given the current order of field processing, the duct cases require interpolation on the 2D yz plane, which is achieved by setting C_fine_x to zero, and doing 2D interpolation in griddata. 
+    Given the current order of field processing, the duct cases require interpolation on the 2D yz plane, which is achieved by dropping the x coordinate of C_fine and C_coarse, and doing 2D interpolation. 
     This problem arises from the two data-containing yz planes not having the same x coordinate.
+    The other arguments are as in interpolate_fields_fine_coarse.
     """
     print('[dataFoam] Interpolating DUCT fields from '+fine_field_dir+' to '+coarse_field_dir)
-    C_fine = np.load(os.path.join(fine_field_dir,fine_case_prefix_and_name+'_C.npy'))
-    C_fine[:,0] = np.zeros(len(C_fine))
-    C_coarse = np.load(os.path.join(coarse_field_dir,coarse_case_prefix_and_name+'_C.npy'))
+    fine_C_file = os.path.join(fine_field_dir,fine_case_prefix_and_name+'_C.npy')
+    coarse_C_file = os.path.join(coarse_field_dir,coarse_case_prefix_and_name+'_C.npy')
+    C_fine = np.load(fine_C_file,mmap_mode='r')[:,1:]
+    C_coarse = np.load(coarse_C_file,mmap_mode='r')[:,1:]
+    fine_V_file = os.path.join(fine_field_dir,fine_case_prefix_and_name+'_V.npy')
+    V_fine = np.load(fine_V_file,mmap_mode='r') if interp_method == 'volume_average' else None
     
     print('[dataFoam] Fine field: '+fine_case_prefix_and_name+', '+str(len(C_fine))+ ' points')
     print('[dataFoam] Coarse field: '+coarse_case_prefix_and_name+', '+str(len(C_coarse))+ ' points')
 
-    for field_name in fields_list:
-        print('[dataFoam] Interpolating '+field_name + ' using method '+interp_method)
-        field_fine = np.load(os.path.join(fine_field_dir,fine_case_prefix_and_name+'_'+field_name+'.npy'))
-        interp_field = griddata(C_fine[:,1:],
-                                field_fine,
-                                C_coarse[:,1:],
-                                method=interp_method)
-
-        if interp_method != 'nearest':
-            ind_nan = np.argwhere(np.isnan(interp_field))
-            if len(ind_nan) >0:
-                print('[dataFoam] Interpolation found '+ str(len(ind_nan))+' nans, using nearest to fill these nans in')
-                interp_field[ind_nan] = griddata(C_fine[:,1:],
-                                                field_fine,
-                                                C_coarse[ind_nan][:,1:], method='nearest')
-        print('[dataFoam] Saving interpolated field to ' + str(os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy')))
-        np.save(os.path.join(output_dir,output_case_prefix_and_name+'_'+field_name+'.npy'),interp_field)        
+    if tile_points is not None:
+        return map_fields_fine_coarse_tiled(fine_C_file,coarse_C_file,slice(1,None),fine_field_dir,output_dir,fine_case_prefix_and_name,output_case_prefix_and_name,
+                                            fields_list,interp_method,tile_points,tile_halo,workers)
+
+    weights_cache_file = None
+    if weights_cache_dir is not None and interp_method in MAPPER_METHODS:
+        weights_cache_file = get_weights_cache_file(weights_cache_dir,fine_C_file,coarse_C_file,interp_method,'yz',fine_V_file)
+    return map_fields_fine_coarse(C_fine,C_coarse,fine_field_dir,output_dir,fine_case_prefix_and_name,output_case_prefix_and_name,fields_list,interp_method,
+                                  weights_cache_file,weights_cache_size,V_fine)
@@ -20,6 +20,11 @@ C = np.load(os.path.join(dataFoam_folder,'test_data/numpy/komegasst_case_1p0_C.n
 print(f'[dataFoam tests] Checking correct number of cells is read....')
 assert len(C) == 14751
 
+# Check cell volumes are read, and are all positive
+V = np.load(os.path.join(dataFoam_folder,'test_data/numpy/komegasst_case_1p0_V.npy'))
+print(f'[dataFoam tests] Checking cell volumes are positive....')
+assert (len(V) == 14751) & (V > 0).all()
+
 # Check scalars, vectors, symmtensors, and tensors are read correctly
 k = np.load(os.path.join(dataFoam_folder,'test_data/numpy/komegasst_case_1p0_k.npy'))
 U = np.load(os.path.join(dataFoam_folder,'test_data/numpy/komegasst_case_1p0_U.npy'))
@@ -133,6 +138,17 @@ assert np.sum(abs(I2_25)) < 1E-10
 assert np.sum(abs(I1_29)) > 1E-10
 assert np.sum(abs(I2_29)) < 1E-10
 
+# Check the numpy RANS features against the fields written by writeFields_RANS
+print(f'[dataFoam tests] Checking numpy RANS features against writeFields_RANS....')
+from preprocessing.calculate_rans_features import calc_rans_features, read_nu
+load_field = lambda field: np.load(os.path.join(dataFoam_folder,f'test_data/numpy/komegasst_case_1p0_{field}.npy'))
+rans_features = calc_rans_features(gradU,k,load_field('nut'),read_nu(os.path.join(dataFoam_folder,'test_data/case_1p0')),
+                                   omega=load_field('omega'),wallDistance=load_field('wallDistance'),gradk=load_field('gradk'),gradomega=load_field('gradomega'))
+for field, foam_field in [('Shat',Shat),('Rhat',Rhat),('T1',T1),('T2',T2),('T5',T5),('T10',T10),('I1_25',I1_25),('I2_8',I2_8),('I1_29',I1_29)]:
+    assert np.max(abs(rans_features[field] - foam_field)) <= 1E-5*np.max(abs(foam_field)) + 1E-30
+for i in range(4):
+    assert np.allclose(rans_features[f'q{i+1}'],load_field(f'q{i+1}'),rtol=1E-4,atol=1E-10)
+
 # Check symmetry of S, and anti-symmetry of R
 print(f'[dataFoam tests] Checking symmetric and zero trace basis tensors and S')
 R = np.load(os.path.join(dataFoam_folder,'test_data/numpy/komegasst_case_1p0_R.npy'))
@@ -224,6 +240,183 @@ for i in range(47):
     assert (max(abs((I1_i_base - I1_i_xyz70))) < 1E-8)
     assert (max(abs((I2_i_base - I2_i_xyz70))) < 1E-8)
 
+# Check fine to coarse mapping of tensor fields
+from preprocessing.map_coarse_fine import FineCoarseMapper, interpolate_field_griddata
+print(f'[dataFoam tests] Checking fine to coarse mapping of tensor fields....')
+C_fine = C[:,0:2]
+C_coarse = np.vstack([0.9*C_fine[::7] + 0.1*C_fine.mean(axis=0), C_fine.min(axis=0) - 0.1]) # last point is outside the fine mesh
+mapper = FineCoarseMapper(C_fine,C_coarse,'linear')
+assert mapper.n_outside == 1
+
+# A linear tensor field is reproduced by linear interpolation
+A = np.arange(9).reshape(3,3)
+T_linear = A + C_fine[:,0,None,None]*A.T - 2*C_fine[:,1,None,None]
+T_linear_coarse = mapper.map(T_linear)
+assert T_linear_coarse.shape == (len(C_coarse),3,3)
+assert np.max(abs(T_linear_coarse[:-1] - (A + C_coarse[:-1,0,None,None]*A.T - 2*C_coarse[:-1,1,None,None]))) < 1E-8
+
+# Mapping all components at once is the same as mapping each component, and each field, separately
+gradU_coarse, k_coarse = mapper.map_fields([gradU,k])
+assert np.array_equal(gradU_coarse[:,0,1],mapper.map(gradU[:,0,1])) & np.array_equal(k_coarse,mapper.map(k))
+
+# Fine rows with a nan in any component are left out for all components. Coarse rows that do not use them are unchanged, and no nans are left
+T_nan = T_linear.copy()
+T_nan[::50,1,2] = np.nan
+T_nan_coarse = mapper.map(T_nan)
+nan_rows = np.isnan(mapper.weights @ T_nan[:,1,2])
+assert nan_rows.any() & ~np.isnan(T_nan_coarse).any()
+assert np.max(abs(T_nan_coarse[~nan_rows] - T_linear_coarse[~nan_rows])) < 1E-12
+
+# griddata methods without precomputed weights keep the tensor shape and fill nans by row
+gradU_cubic = interpolate_field_griddata(C_fine,gradU,C_coarse,'cubic')
+assert (gradU_cubic.shape == (len(C_coarse),3,3)) & ~np.isnan(gradU_cubic).any()
+
+# The volume average onto coarser cells conserves the volume integral of a field, and keeps constant fields constant
+mapper = FineCoarseMapper(C_fine,C_fine[::7],'volume_average',V)
+k_coarse = mapper.map(k)
+from scipy.spatial import cKDTree
+coarse_volumes = np.bincount(cKDTree(C_fine[::7]).query(C_fine)[1],weights=V) # volume of the fine cells binned into each coarse cell
+assert abs(np.sum(coarse_volumes*k_coarse) - np.sum(V*k)) < 1E-10*np.sum(V*k)
+assert np.max(abs(mapper.map(np.ones((len(C_fine),3,3))) - 1)) < 1E-12
+
+# Tiled interpolation with a halo wider than half a tile matches the untiled mapping (nearest would pick another fine point if any were missed)
+from preprocessing.map_coarse_fine import map_fields_fine_coarse_tiled
+import tempfile
+with tempfile.TemporaryDirectory() as tmp_dir:
+    C_tiled = 0.9*C_fine[::7] + 0.1*C_fine.mean(axis=0)
+    np.save(os.path.join(tmp_dir,'fine_C.npy'),C_fine)
+    np.save(os.path.join(tmp_dir,'coarse_C.npy'),C_tiled)
+    np.save(os.path.join(tmp_dir,'fine_k.npy'),k)
+    map_fields_fine_coarse_tiled(os.path.join(tmp_dir,'fine_C.npy'),os.path.join(tmp_dir,'coarse_C.npy'),slice(0,2),tmp_dir,tmp_dir,'fine','tiled',['k'],'nearest',
+                                 tile_points=200,tile_halo=0.7)
+    assert np.array_equal(np.load(os.path.join(tmp_dir,'tiled_k.npy')),FineCoarseMapper(C_fine,C_tiled,'nearest').map(k))
+
+# Check writeFoam_* fields round trip through readFoamField in ascii, binary and gzipped binary
+print(f'[dataFoam tests] Checking ascii and binary writeFoam round trips....')
+import tempfile
+from utilities.foamIO.readFoam import readFoamField, get_endtime, select_times
+from utilities.foamIO.writeFoam_CUBE import writeFoam_ap_CUBE, writeFoam_anyfield_CUBE
+from utilities.foamIO.writeFoam_PHLL import writeFoam_nut_L_PHLL
+from utilities.foamIO.writeFoam_DUCT import writeFoam_U_DUCT
+from utilities.foamIO.writeFoam import FoamFieldWriter
+aperp = S - np.trace(S,axis1=1,axis2=2)[:,None,None]/3*np.identity(3)
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for write_format, write_compression in [('ascii',False),('binary',False),('binary',True)]:
+        writeFoam_ap_CUBE(os.path.join(tmp_dir,'aperp'),aperp,write_format,write_compression)
+        writeFoam_nut_L_PHLL(os.path.join(tmp_dir,'nut_L'),k,write_format,write_compression)
+        writeFoam_U_DUCT(os.path.join(tmp_dir,'U'),U,write_format,write_compression)
+        writeFoam_anyfield_CUBE(gradU,os.path.join(tmp_dir,'gradU'),write_format,write_compression)
+        assert os.path.isfile(os.path.join(tmp_dir,'U.gz')) == write_compression
+        assert np.max(abs(readFoamField(os.path.join(tmp_dir,'aperp')) - aperp)) < 1E-12
+        assert np.array_equal(readFoamField(os.path.join(tmp_dir,'nut_L')),k) & np.array_equal(readFoamField(os.path.join(tmp_dir,'U')),U)
+        assert np.array_equal(readFoamField(os.path.join(tmp_dir,'gradU')),gradU)
+    # The generic writer generates the boundaryField from the case's patches
+    writer = FoamFieldWriter(os.path.join(dataFoam_folder,'test_data/case_1p0'))
+    assert writer.patches == [('bottomWall','wall'),('defaultFaces','empty'),('inlet','cyclic'),('outlet','cyclic'),('topWall','wall')]
+    for i, field in enumerate([k,U,aperp[:,[0,0,0,1,1,2],[0,1,2,1,2,2]],gradU]):
+        writer.write_field(os.path.join(tmp_dir,f'field_{i}'),field,write_format='binary')
+        assert np.array_equal(readFoamField(os.path.join(tmp_dir,f'field_{i}')),field if i < 2 else (aperp if i == 2 else gradU))
+    boundary_field = open(os.path.join(tmp_dir,'field_0'),'rb').read().split(b'boundaryField')[1]
+    assert (b'defaultFaces\n    {\n        type            empty;' in boundary_field) & (b'topWall\n    {\n        type            fixedValue;' in boundary_field)
+
+# Check fields of a decomposed case are read from the processor directories, in the cell order of the reconstructed case
+print(f'[dataFoam tests] Checking reading decomposed fields....')
+with tempfile.TemporaryDirectory() as tmp_dir:
+    processor_of_cell = np.random.default_rng(0).integers(0,4,len(k))
+    for processor in range(4):
+        cells = np.flatnonzero(processor_of_cell == processor)
+        os.makedirs(os.path.join(tmp_dir,f'processor{processor}','constant','polyMesh'))
+        os.makedirs(os.path.join(tmp_dir,f'processor{processor}','20000'))
+        with open(os.path.join(tmp_dir,f'processor{processor}','constant','polyMesh','cellProcAddressing'),'w') as file:
+            file.write('FoamFile\n{\n    format      ascii;\n    class       labelList;\n}\n'+str(len(cells))+'\n(\n'+'\n'.join(map(str,cells))+'\n)\n')
+        writer.write_field(os.path.join(tmp_dir,f'processor{processor}','20000','k'),k[cells],write_format=['ascii','binary'][processor%2])
+        writer.write_field(os.path.join(tmp_dir,f'processor{processor}','20000','gradU'),gradU[cells],write_format=['binary','ascii'][processor%2],write_compression=processor==3)
+        # Uniform on every processor, with a different value on each
+        with open(os.path.join(tmp_dir,f'processor{processor}','20000','nut'),'w') as file:
+            file.write('FoamFile\n{\n    format      ascii;\n    class       volScalarField;\n}\ninternalField   uniform '+str(processor)+';\n')
+        with open(os.path.join(tmp_dir,f'processor{processor}','20000','Uuniform'),'w') as file:
+            file.write('FoamFile\n{\n    format      ascii;\n    class       volVectorField;\n}\ninternalField   uniform ('+str(processor)+' 0 1);\n')
+    assert get_endtime(tmp_dir) == '20000'
+    assert np.array_equal(readFoamField(os.path.join(tmp_dir,'20000','k')),k)
+    assert np.array_equal(readFoamField(os.path.join(tmp_dir,'20000','gradU'),workers=2),gradU)
+    assert np.array_equal(readFoamField(os.path.join(tmp_dir,'20000','nut')),processor_of_cell)
+    assert np.array_equal(readFoamField(os.path.join(tmp_dir,'20000','Uuniform')),np.c_[processor_of_cell,np.zeros(len(k)),np.ones(len(k))])
+
+# Check time directories are ordered by their float time, and selected by time, name or range
+print(f'[dataFoam tests] Checking time directory selection....')
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for folder in ['0','1e-05','0.005','0.01','100','constant','system','postProcessing','0.orig']:
+        os.makedirs(os.path.join(tmp_dir,folder))
+    assert get_endtime(tmp_dir) == '100'
+    assert select_times(tmp_dir,'all') == ['0','1e-05','0.005','0.01','100']
+    assert (select_times(tmp_dir,0.005) == ['0.005']) & (select_times(tmp_dir,'1e-05:0.01') == ['1e-05','0.005','0.01']) & (select_times(tmp_dir,'0.01:') == ['0.01','100'])
+
+# Check time series of a decomposed case are stacked in time order, with fields missing at a time saved as NaN
+print(f'[dataFoam tests] Checking time series extraction....')
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for processor in range(2):
+        cells = np.flatnonzero(processor_of_cell % 2 == processor)
+        os.makedirs(os.path.join(tmp_dir,'case',f'processor{processor}','constant','polyMesh'))
+        with open(os.path.join(tmp_dir,'case',f'processor{processor}','constant','polyMesh','cellProcAddressing'),'w') as file:
+            file.write('FoamFile\n{\n    format      ascii;\n    class       labelList;\n}\n'+str(len(cells))+'\n(\n'+'\n'.join(map(str,cells))+'\n)\n')
+        for i, time_name in enumerate(['0.5','1','10']):
+            os.makedirs(os.path.join(tmp_dir,'case',f'processor{processor}',time_name))
+            writer.write_field(os.path.join(tmp_dir,'case',f'processor{processor}',time_name,'U'),U[cells]*i,write_format=['ascii','binary'][processor])
+            if time_name != '1':
+                writer.write_field(os.path.join(tmp_dir,'case',f'processor{processor}',time_name,'k'),k[cells]*i)
+    time_series_case = MLDatasetFromFoamCase(tmp_dir,tmp_dir,'case','LES','writeFields_LES')
+    time_series_case.saveTimeSeries('time_series',fields_list=['U','k'],workers=2)
+    assert np.array_equal(np.load(os.path.join(tmp_dir,'time_series_times.npy')),[0.5,1,10])
+    assert np.array_equal(np.load(os.path.join(tmp_dir,'time_series_U_series.npy'),mmap_mode='r')[1:],[U,U*2])
+    k_series = np.load(os.path.join(tmp_dir,'time_series_k_series.npy'))
+    assert np.array_equal(k_series[[0,2]],[k*0,k*2]) & np.isnan(k_series[1]).all()
+    # A nonuniform field with the wrong number of cells is rejected, not expanded like a uniform value
+    os.makedirs(os.path.join(tmp_dir,'case','10'))
+    writer.write_field(os.path.join(tmp_dir,'case','10','k'),k[:3])
+    try:
+        time_series_case.saveTimeSeries('time_series',fields_list=['k'],times='10')
+        assert False
+    except ValueError:
+        pass
+
+# Check the tensor basis fit recovers known coefficients, and refits cells with a negative g1 with g1 = 0
+from preprocessing.calculate_optimal_fits import tensor_basis_fit
+print(f'[dataFoam tests] Checking tensor basis coefficient fits....')
+rng = np.random.default_rng(0)
+T_basis = rng.normal(size=(1000,5,3,3))
+T_basis = T_basis + T_basis.transpose(0,1,3,2) # 5 symmetric basis tensors, so the 6 x 5 systems have a unique solution
+g_true = rng.normal(size=(1000,5))
+g_true[:,0] = abs(g_true[:,0])
+g_fit, r2_fit = tensor_basis_fit(T_basis,np.einsum('ij,ijkl->ikl',g_true,T_basis))
+assert (np.max(abs(g_fit - g_true)) < 1E-8) & (np.min(r2_fit) > 1 - 1E-10)
+g_true[::2,0] = -g_true[::2,0]
+y_negative = np.einsum('ij,ijkl->ikl',g_true,T_basis)
+assert np.max(abs(tensor_basis_fit(T_basis,y_negative,nonnegative_g1=False)[0] - g_true)) < 1E-8
+g_fit, r2_fit = tensor_basis_fit(T_basis,y_negative)
+assert (g_fit[:,0] >= 0).all() & (g_fit[::2,0] == 0).all() & (np.max(abs(g_fit[1::2] - g_true[1::2])) < 1E-8)
+# The refitted cells are the least-squares fits of the 6 independent components without T1
+symm_components = [0,1,2,4,5,8]
+g_refit = np.linalg.lstsq(T_basis[0,1:].reshape(4,9)[:,symm_components].T,y_negative[0].ravel()[symm_components],rcond=None)[0]
+assert np.max(abs(g_fit[0,1:] - g_refit)) < 1E-8
+
+# Check LazyDataset indexing over several cases matches numpy indexing of the concatenated field
+from utilities.dataset import LazyDataset
+print(f'[dataFoam tests] Checking lazy dataset indexing....')
+with tempfile.TemporaryDirectory() as tmp_dir:
+    os.makedirs(os.path.join(tmp_dir,'komegasst'))
+    np.save(os.path.join(tmp_dir,'komegasst','komegasst_part1_U.npy'),U[:5000])
+    np.save(os.path.join(tmp_dir,'komegasst','komegasst_part2_U.npy'),U[5000:])
+    with LazyDataset(tmp_dir,'komegasst',['part1','part2'],'U') as U_lazy:
+        assert (len(U_lazy) == len(U)) & np.array_equal(U_lazy[-1],U[-1]) & np.array_equal(U_lazy[4990:5010],U[4990:5010])
+        mask = U[:,0] > np.median(U[:,0])
+        assert np.array_equal(U_lazy[mask],U[mask]) & np.array_equal(U_lazy[np.array([5000,-1,3])],U[[5000,-1,3]])
+        for index in [len(U),-len(U)-5,np.array([0,len(U)]),mask[:10]]:
+            try:
+                U_lazy[index]
+                assert False
+            except IndexError:
+                pass
+
 print(f'================================================================')
 print(f'[dataFoam tests] All assertions passed.')
 print(f'================================================================')
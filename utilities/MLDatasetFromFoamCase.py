@@ -7,9 +7,19 @@ Created on Thu Oct 21 13:22:26 2021
 """
 
 import os
+import time
+import subprocess
 import numpy as np
-from dataFoam.utilities.foamIO.readFoam import readFoamField, get_endtime, get_cell_centres
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from dataFoam.utilities.foamIO.readFoam import readFoamField, select_times, get_cell_centres_volumes, get_cell_count, find_foam_file, get_decomposed_field_files, get_processor_directories, read_cell_proc_addressing, reshape_symmTensor, reshape_tensor
 from dataFoam.utilities.foamIO.changeFoamSystemDictEntry import changeFoamSystemDictEntry
+from dataFoam.utilities.foamIO.stageFoamCase import stageFoamCase
+from dataFoam.utilities.datasetContainer import FoamDatasetContainer, get_container_file
+from dataFoam.utilities.extractionManifest import load_manifest, save_manifest, get_sources_signature, is_up_to_date, get_directory_files
+
+# Fields saved by saveTimeSeries by default
+TIME_SERIES_FIELDS = ['U','p','k']
 
 class MLDatasetFromFoamCase: 
     """ 
@@ -18,7 +28,7 @@ class MLDatasetFromFoamCase:
     RANS case types store the full set of invariants, while reference cases (LES/DNS) only store U/gradU/tau related fields.
     """
 
-    def __init__(self,data_save_path,foam_parent_dir,case_name,case_type,write_fields_application,write_fields_flag=True):
+    def __init__(self,data_save_path,foam_parent_dir,case_name,case_type,write_fields_application,write_fields_flag=True,stage_method='copy',incremental_flag=False,time='latestTime'):
         """Constructor
         data_save_path: output numpy folder
         foam_parent_directory - e.g., the komegasst foam dataset directory, which contains all of the komegasst cases
@@ -26,6 +36,9 @@ class MLDatasetFromFoamCase:
         case_type: kepsilonphitf, komegasst, reference (see if statements below)
         write_fields_application: name of OpenFOAM application called to write the additional fields (see dataFoam/foam_applications)
         overwrite_flag: whether to call the write_fields_application, which may be time consuming
+        stage_method: 'copy' copies the whole case to the writeFields directory, 'link' only stages constant/, system/ (symlinked) and the latest time (see stageFoamCase)
+        incremental_flag: skip writeFields, and fields in saveDataset, whose source files are unchanged since they were last processed
+        time: time directory to extract, 'latestTime' or a specific time (a number or time name, see readFoam.select_times)
         """
 
         print('[dataFoam] Initializing MLDatasetFromFoamCase....')
@@ -39,6 +52,9 @@ class MLDatasetFromFoamCase:
         self.case_name = case_name
         self.data_save_path = data_save_path
         self.write_fields_flag=write_fields_flag
+        self.stage_method=stage_method
+        self.incremental_flag=incremental_flag
+        self.time=time
 
 
         if self.case_type == 'kepsilon':
@@ -64,7 +80,8 @@ class MLDatasetFromFoamCase:
                                 'S',
                                 'R',
                                 'skewness',
-                                'C'
+                                'C',
+                                'V'
                                 ]
             self.read_invariants_flag = False
             self.read_basis_tensors_flag = False
@@ -101,7 +118,8 @@ class MLDatasetFromFoamCase:
                                 'S',
                                 'R',
                                 'skewness',
-                                'C'
+                                'C',
+                                'V'
                                 ]
             self.read_invariants_flag = False
             self.read_basis_tensors_flag = False
@@ -131,7 +149,8 @@ class MLDatasetFromFoamCase:
                                 'S',
                                 'R',
                                 'skewness',
-                                'C'
+                                'C',
+                                'V'
                                 ]
             self.read_invariants_flag = False
             self.read_basis_tensors_flag = False
@@ -150,7 +169,8 @@ class MLDatasetFromFoamCase:
                                 'kMean_tauMean',
                                 'aMean',
                                 'bMean',
-                                'C'
+                                'C',
+                                'V'
                                 ]
             self.read_invariants_flag = False
             self.read_basis_tensors_flag = False
@@ -169,7 +189,8 @@ class MLDatasetFromFoamCase:
                                 'k',
                                 'a',
                                 'b',
-                                'C'
+                                'C',
+                                'V'
                                 ]
             self.read_invariants_flag = False
             self.read_basis_tensors_flag = False
@@ -197,43 +218,269 @@ class MLDatasetFromFoamCase:
         print(self.foam_field_list)
 
     def writeFields(self):
-        """Copies the foam case to the writeFields directory, changes startTime to latestTime, then calls the write_fields_application"""
-        if not os.path.isdir(os.path.join(self.foam_parent_dir, 'writeFields')):
-            os.mkdir(os.path.join(self.foam_parent_dir, 'writeFields'))
+        """Copies (or stages, see stage_method) the foam case to the writeFields directory, starts it from the extracted time (see the time argument), then calls the write_fields_application
+        With incremental_flag, this is skipped if the case inputs (constant, system, latest time) and application are unchanged since the last successful run.
+        """
+        os.makedirs(os.path.join(self.foam_parent_dir, 'writeFields'),exist_ok=True)
 
         self.writeFieldsDirectory = os.path.join(self.foam_parent_dir,'writeFields',self.case_name)
         if (self.write_fields_flag):
+            # The write_fields_application runs in serial, so it needs the reconstructed time directory
+            if not os.path.isdir(os.path.join(self.directory,self.get_time())) and get_processor_directories(self.directory):
+                raise ValueError(f'[dataFoam] Time {self.get_time()} of {self.directory} only exists in the processor directories. '
+                                 +'Reconstruct the case (reconstructPar) before writing fields')
+            if self.incremental_flag:
+                self.endtime = self.get_time()
+                manifest_file = os.path.join(self.writeFieldsDirectory,'dataFoam_manifest.json')
+                entry = load_manifest(manifest_file).get('case')
+                sources = get_directory_files([os.path.join(self.directory,folder) for folder in ['constant','system',self.endtime]])
+                signatures = get_sources_signature(sources,entry)
+                if is_up_to_date(entry,signatures,self.writeFieldsDirectory) and entry.get('application') == self.writeFieldsApplication:
+                    print('[dataFoam] Case inputs unchanged since the last writeFields, skipping writing fields....')
+                    return
             print('[dataFoam] Writing new fields....')
-            if (os.path.isdir(os.path.join(self.writeFieldsDirectory))):
-                os.system(f'rm -rf {self.writeFieldsDirectory}')
-            os.system('cp -rf '+self.directory+' '+self.writeFieldsDirectory)
-            os.chdir(self.writeFieldsDirectory)
-            changeFoamSystemDictEntry(os.path.join(self.writeFieldsDirectory),'controlDict','startFrom','latestTime')
+            if self.stage_method == 'link':
+                stageFoamCase(self.directory,self.writeFieldsDirectory,self.get_time())
+            else:
+                if (os.path.isdir(os.path.join(self.writeFieldsDirectory))):
+                    os.system(f'rm -rf {self.writeFieldsDirectory}')
+                os.system('cp -rf '+self.directory+' '+self.writeFieldsDirectory)
+            if self.time == 'latestTime':
+                changeFoamSystemDictEntry(os.path.join(self.writeFieldsDirectory),'controlDict','startFrom','latestTime')
+            else:
+                changeFoamSystemDictEntry(os.path.join(self.writeFieldsDirectory),'controlDict','startFrom','startTime')
+                changeFoamSystemDictEntry(os.path.join(self.writeFieldsDirectory),'controlDict','startTime',self.get_time())
+            # Applications run with cwd set for the subprocess only, so several cases can be processed concurrently
             if self.save_mesh_skewness:
                 print(f'[dataFoam] Running checkMesh....')
-                self.endtime = get_endtime(self.directory)
-                os.system(f'checkMesh -writeFields skewness -time {self.endtime} > log.checkMesh')
-            print('[dataFoam] Getting cell centres for the case....')
-            self.C = get_cell_centres(self.writeFieldsDirectory)  
+                self.endtime = self.get_time()
+                subprocess.call(f'checkMesh -writeFields skewness -time {self.endtime} > log.checkMesh',shell=True,cwd=self.writeFieldsDirectory)
             print(f'[dataFoam] Running {self.writeFieldsApplication}....')
-            os.system(f'{self.writeFieldsApplication} > log.writeFields')
+            return_code = subprocess.call(f'{self.writeFieldsApplication} > log.writeFields',shell=True,cwd=self.writeFieldsDirectory)
+            if self.incremental_flag and return_code == 0:
+                save_manifest(manifest_file,{'case': {'sources': signatures, 'output': self.writeFieldsDirectory, 'application': self.writeFieldsApplication}})
         else:
             print('[dataFoam] Skipping writing fields....')
         return
 
-    def saveDataset(self,dataset_prefix):
-        """Read foam fields, save foam fields as numpy binaries"""
-        self.endtime = get_endtime(self.directory)
-        self.foamdatatime = os.path.join(self.writeFieldsDirectory,str(self.endtime))
+    def saveDataset(self,dataset_prefix,workers=1,output_format='npy',compression=None):
+        """Read foam fields, save foam fields as numpy binaries
+        workers: number of processes reading and saving fields in parallel. Fields are independent, so this scales with the number of fields.
+        Logging is always printed in the order of self.foam_field_list.
+        With incremental_flag, fields whose source files are unchanged since they were last saved (see {dataset_prefix}_manifest.json) are skipped.
+        The manifest is updated as each field is saved.
+        output_format: 'npy' saves {dataset_prefix}_{field}.npy per field, 'hdf5' saves every field to one {dataset_prefix}.h5 container (see datasetContainer)
+        compression: compression of the container fields, None, 'gzip' or 'lzf'
+        """
+        self.endtime = self.get_time()
+        self.foamdatatime = os.path.join(self.writeFieldsDirectory,self.endtime)
         self.dataset_prefix = dataset_prefix #+ '_'+self.case_name
         self.save_dir = os.path.join(self.data_save_path,dataset_prefix)
+        self.output_format = output_format
+
+        container = None
+        if self.output_format == 'hdf5':
+            container = FoamDatasetContainer(get_container_file(self.data_save_path,self.dataset_prefix),mode='a',compression=compression)
+            container.set_metadata(case_type=self.case_type,case_name=self.case_name,dataset_prefix=self.dataset_prefix,endtime=self.endtime)
+
+        mesh_field_names = ['C','V']
+        manifest_file = os.path.join(self.data_save_path,self.dataset_prefix+'_manifest.json')
+        manifest = load_manifest(manifest_file) if self.incremental_flag else {}
+        signatures = {}
+        up_to_date = set()
+        if self.incremental_flag:
+            for field in self.foam_field_list:
+                signatures[field] = get_sources_signature(self.get_field_sources(field),manifest.get(field))
+                if is_up_to_date(manifest.get(field),signatures[field],self.get_output(field)) and (container is None or field in container):
+                    up_to_date.add(field)
+            print(f'[dataFoam] {len(up_to_date)}/{len(self.foam_field_list)} fields unchanged since the last extraction.')
+
+        print('[dataFoam] Getting cell centres and volumes for the case....')
+        if all(field in up_to_date for field in mesh_field_names):
+            self.C, self.V = self.load_saved_field('C',container), self.load_saved_field('V',container)
+        else:
+            self.C, self.V = get_cell_centres_volumes(self.directory)
+        mesh_fields = {'C': self.C, 'V': self.V}
+
+        print(f'[dataFoam] Reading fields with {workers} worker(s).... ')
+        start_time = time.perf_counter()
+        foam_fields = [field for field in self.foam_field_list if field not in mesh_fields and field not in up_to_date]
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            # Fields going to a container are returned to this process, since only one process can write to it
+            results = (executor.map if executor else map)(saveFoamField,
+                                                          [os.path.join(self.foamdatatime,field) for field in foam_fields],
+                                                          [self.get_save_file(field) if container is None else None for field in foam_fields],
+                                                          repeat(len(self.C)))
+            for field in self.foam_field_list:
+                if field in up_to_date:
+                    print(f'[dataFoam] Skipping {field}, unchanged since the last extraction')
+                    continue
+                if field in mesh_fields:
+                    foamfield, uniform_value, field_time = mesh_fields[field], None, 0.0
+                else:
+                    shape, uniform_value, field_time, foamfield = next(results)
+                write_start_time = time.perf_counter()
+                if container is not None:
+                    container.write_field(field,foamfield)
+                elif field in mesh_fields:
+                    np.save(self.get_save_file(field),foamfield)
+                if foamfield is not None:
+                    shape = foamfield.shape
+                field_time += time.perf_counter()-write_start_time
+                # Logged here rather than by the workers, so the log is in the order of self.foam_field_list
+                processor_files = None if field in mesh_fields else get_decomposed_field_files(os.path.join(self.foamdatatime,field))
+                if processor_files is not None:
+                    print(f'[dataFoam] Read {field} from {len(processor_files)} processor directories')
+                if uniform_value is not None:
+                    print(f'[dataFoam] Field {field} is all {uniform_value}.')
+                print(f'[dataFoam] Saving {field}, with shape {shape} ({field_time:.3f} s)')
+                if self.incremental_flag:
+                    # Recorded as soon as the field is saved, so a killed job only redoes the fields it had not finished
+                    if container is not None:
+                        container.file.flush()
+                    manifest[field] = {'sources': signatures[field], 'output': self.get_output(field)}
+                    save_manifest(manifest_file,manifest)
+        finally:
+            if executor:
+                executor.shutdown()
+            if container is not None:
+                container.close()
+        print(f'[dataFoam] Saved {len(self.foam_field_list)-len(up_to_date)} fields in {time.perf_counter()-start_time:.2f} s')
+        return
+
+    def saveTimeSeries(self,dataset_prefix,fields_list=TIME_SERIES_FIELDS,times='all',workers=1):
+        """Saves per-cell time series of fields, e.g. for unsteady LES cases, read from the time directories of the case selected by times
+        ('all', a 'start:end' range, a (start, end) tuple..., see readFoam.select_times).
+        Each field is saved to {dataset_prefix}_{field}_series.npy, an n_times x n_cells (x components) array preallocated on disk,
+        and the times to {dataset_prefix}_times.npy. The arrays are time-major, so a window of consecutive time steps is one contiguous read,
+        e.g. np.load(file,mmap_mode='r')[t0:t1].
+        workers: processes reading time steps in parallel. Each time step is written straight into the memory-mapped arrays by the process
+        that read it, so only the time steps being read are in memory. Fields missing at a time are saved as NaN.
+        """
+        time_names = select_times(self.directory,times)
+        time_directories = [os.path.join(self.directory,time_name) for time_name in time_names]
+        print(f'[dataFoam] Saving time series of {fields_list} for {len(time_names)} times ({time_names[0]} to {time_names[-1]}) with {workers} worker(s)....')
+        start_time = time.perf_counter()
+        np.save(os.path.join(self.data_save_path,dataset_prefix+'_times.npy'),np.array([float(time_name) for time_name in time_names]))
+
+        # The per-cell shape of each field is taken from the first time that has it
+        n_cells = get_case_cell_count(self.directory)
+        save_files = [os.path.join(self.data_save_path,dataset_prefix+'_'+field+'_series.npy') for field in fields_list]
+        for field, save_file in zip(fields_list,save_files):
+            foam_file = next((os.path.join(time_directory,field) for time_directory in time_directories if is_foam_field(os.path.join(time_directory,field))),None)
+            if foam_file is None:
+                raise LookupError(f'[dataFoam] Field {field} was not found in any of the selected times of '+self.directory)
+            shape = expand_uniform_field(*readFoamField(foam_file,return_uniform=True),n_cells,foam_file).shape
+            print(f'[dataFoam] Saving {field} to {save_file}, with shape {(len(time_names),)+shape}')
+            np.lib.format.open_memmap(save_file,mode='w+',dtype=np.float64,shape=(len(time_names),)+shape)
+
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            results = (executor.map if executor else map)(saveFoamTimeStep,time_directories,repeat(fields_list),repeat(save_files),range(len(time_names)),repeat(n_cells))
+            for time_name, (missing, step_time) in zip(time_names,results):
+                if missing:
+                    print(f'[dataFoam] WARNING! {missing} not found at time {time_name}, saved as NaN.')
+                decomposed = '' if os.path.isdir(os.path.join(self.directory,time_name)) else ' from the processor directories'
+                print(f'[dataFoam] Saved time {time_name}{decomposed} ({step_time:.3f} s)')
+        finally:
+            if executor:
+                executor.shutdown()
+        print(f'[dataFoam] Saved time series of {len(fields_list)} fields for {len(time_names)} times in {time.perf_counter()-start_time:.2f} s')
+        return
+
+    def get_time(self):
+        # Name of the time directory extracted (see the time argument). The time index of the case is cached, so this does not rescan the case.
+        times = select_times(self.directory,self.time)
+        if len(times) != 1:
+            raise ValueError(f'[dataFoam] time must select a single time directory, but {self.time} selects {len(times)}')
+        print('[dataFoam] Found time: '+times[0])
+        return times[0]
+
+    def get_save_file(self,field):
+        return os.path.join(self.data_save_path,self.dataset_prefix+'_'+field+'.npy')
+
+    def get_output(self,field):
+        # File a field is saved to, depending on the output_format.
+        if self.output_format == 'hdf5':
+            return get_container_file(self.data_save_path,self.dataset_prefix)
+        return self.get_save_file(field)
+
+    def load_saved_field(self,field,container=None):
+        if container is not None:
+            return container[field][()]
+        return np.load(self.get_save_file(field))
+
+    def get_field_sources(self,field):
+        # Source files a saved field is made from: the polyMesh for C and V, otherwise the foam field file itself (or its processor files, for a decomposed case).
+        if field in ['C','V']:
+            mesh_directories = [self.directory]
+            if not os.path.isfile(find_foam_file(os.path.join(self.directory,'constant','polyMesh','owner'))):
+                mesh_directories = get_processor_directories(self.directory)
+            return [find_foam_file(os.path.join(mesh_directory,'constant','polyMesh',mesh_file)) for mesh_directory in mesh_directories for mesh_file in ['points','faces','owner','neighbour']]
+        processor_files = get_decomposed_field_files(os.path.join(self.foamdatatime,field))
+        if processor_files is not None:
+            return [find_foam_file(processor_file) for processor_file in processor_files]
+        return [find_foam_file(os.path.join(self.foamdatatime,field))]
+
+def is_foam_field(foam_file):
+    # True if foam_file exists (compressed, or decomposed and not reconstructed)
+    return os.path.isfile(find_foam_file(foam_file)) or get_decomposed_field_files(foam_file) is not None
 
-        print('[dataFoam] Reading fields.... ')
-        for field in self.foam_field_list:
-            foamfield = readFoamField(os.path.join(self.foamdatatime,field))
-            if isinstance(foamfield,float):
-                print(f'[dataFoam] Field {field} is all {foamfield}.')
-                foamfield = np.ones(len(self.C))*foamfield
-            print(f'[dataFoam] Saving {field}, with shape {foamfield.shape}')
-            np.save(os.path.join(self.data_save_path,self.dataset_prefix+'_'+field+'.npy'),foamfield)  
-        return      
\ No newline at end of file
+def get_case_cell_count(foam_directory):
+    # Number of cells of a case, from the mesh or, for a decomposed case without a reconstructed mesh, from the processor meshes
+    processor_directories = get_processor_directories(foam_directory)
+    if processor_directories and not os.path.isfile(find_foam_file(os.path.join(foam_directory,'constant','polyMesh','neighbour'))):
+        return sum(len(read_cell_proc_addressing(processor_directory)) for processor_directory in processor_directories)
+    return get_cell_count(foam_directory)
+
+def expand_uniform_field(foamfield,uniform,n_cells,file=''):
+    # Expands a uniform field (a float, or the 1D value of a uniform vector/tensor, see readFoamField(return_uniform=True)) to n_cells,
+    # with the same per-cell shape as a nonuniform field. Nonuniform fields must have n_cells values.
+    if not uniform:
+        if len(foamfield) != n_cells:
+            raise ValueError(f'[dataFoam] {file} has {len(foamfield)} values, but the mesh has {n_cells} cells')
+        return foamfield
+    if isinstance(foamfield,float):
+        return np.full(n_cells,foamfield)
+    foamfield = np.tile(foamfield,(n_cells,1))
+    if foamfield.shape[1] == 6:
+        foamfield = reshape_symmTensor(foamfield)
+    elif foamfield.shape[1] == 9:
+        foamfield = reshape_tensor(foamfield)
+    return foamfield
+
+def saveFoamTimeStep(time_directory,fields_list,save_files,time_index,n_cells):
+    """Reads each field of one time directory and writes it into row time_index of its memory-mapped time series (see saveTimeSeries).
+    Uniform fields are expanded to n_cells. Returns the fields missing at this time (written as NaN), and the time taken.
+    Module level so it can run in a process pool.
+    """
+    start_time = time.perf_counter()
+    missing = []
+    for field, save_file in zip(fields_list,save_files):
+        series = np.load(save_file,mmap_mode='r+')
+        foam_file = os.path.join(time_directory,field)
+        if is_foam_field(foam_file):
+            series[time_index] = expand_uniform_field(*readFoamField(foam_file,return_uniform=True),n_cells,foam_file)
+        else:
+            series[time_index] = np.nan
+            missing.append(field)
+        series.flush()
+        del series
+    return missing, time.perf_counter()-start_time
+
+def saveFoamField(foam_file,save_file,n_cells):
+    """Reads one foam field and saves it as a numpy binary. Uniform fields are expanded to n_cells.
+    Returns the saved shape, the uniform value (or None), the time taken, and the field itself if save_file is None (otherwise None).
+    Module level so it can run in a process pool.
+    """
+    start_time = time.perf_counter()
+    foamfield = readFoamField(foam_file)
+    uniform_value = None
+    if isinstance(foamfield,float):
+        uniform_value = foamfield
+        foamfield = np.ones(n_cells)*foamfield
+    if save_file is None:
+        return foamfield.shape, uniform_value, time.perf_counter()-start_time, foamfield
+    np.save(save_file,foamfield)
+    return foamfield.shape, uniform_value, time.perf_counter()-start_time, None
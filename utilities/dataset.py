@@ -1,9 +1,135 @@
 import numpy as np
 import os
+from dataFoam.utilities.datasetContainer import FoamDatasetContainer, get_container_file, load_container_fields
 
 def load_dataset_fields(dataset_folder,genmethod,cases,field):
-    data = np.concatenate([np.load(os.path.join(
-        dataset_folder,genmethod,genmethod+'_'+case+'_'+field + '.npy')) for case in cases])
+    data = np.concatenate([load_case_field(os.path.join(dataset_folder,genmethod),genmethod+'_'+case,field) for case in cases])
     return data
 
+def load_case_field(directory,dataset_prefix,field,mmap_mode=None):
+    # Loads {dataset_prefix}_{field}.npy, or the field from the {dataset_prefix}.h5 container if there is no .npy file.
+    # mmap_mode is passed to np.load for .npy files.
+    npy_file = os.path.join(directory,dataset_prefix+'_'+field+'.npy')
+    container_file = get_container_file(directory,dataset_prefix)
+    if not os.path.isfile(npy_file) and os.path.isfile(container_file):
+        return load_container_fields(container_file,[field])[field]
+    return np.load(npy_file,mmap_mode=mmap_mode)
 
+def load_case_field_shape(directory,dataset_prefix,field):
+    # Shape of the field load_case_field would load, from the .npy header or the container index, without reading the data.
+    npy_file = os.path.join(directory,dataset_prefix+'_'+field+'.npy')
+    container_file = get_container_file(directory,dataset_prefix)
+    if not os.path.isfile(npy_file) and os.path.isfile(container_file):
+        with FoamDatasetContainer(container_file) as container:
+            return tuple(container.index[field]['shape'])
+    return np.load(npy_file,mmap_mode='r').shape
+
+
+class LazyDataset:
+    """
+    Virtual concatenation of one field over several cases, without loading or copying the cases into one array.
+    Each case's .npy is memory-mapped (mmap_mode='r'), or read lazily from its container, and only the rows
+    that are indexed are read. Supports len(), global integer/slice/index-array indexing and batched iteration:
+        U = LazyDataset(dataset_folder,'komegasst',cases,'U')
+        U[0], U[1000:2000], U[np.array([5,100000])]
+        for batch in U.iterate_batches(1024,shuffle=True): ...
+    Boolean masks over all rows are also supported. Cases read from containers keep their file open until close(),
+    or the end of a with block (with LazyDataset(...) as U: ...).
+    Since it has __len__ and __getitem__, it can also be wrapped directly as a map-style dataset for minibatch training.
+    """
+
+    def __init__(self,dataset_folder,genmethod,cases,field):
+        self.field = field
+        self.arrays = [self.open_case_field(os.path.join(dataset_folder,genmethod),genmethod+'_'+case,field) for case in cases]
+        self.offsets = np.concatenate(([0],np.cumsum([len(array) for array in self.arrays])))
+        self.shape = (int(self.offsets[-1]),)+tuple(self.arrays[0].shape[1:])
+        self.dtype = self.arrays[0].dtype
+
+    @staticmethod
+    def open_case_field(directory,dataset_prefix,field):
+        npy_file = os.path.join(directory,dataset_prefix+'_'+field+'.npy')
+        container_file = get_container_file(directory,dataset_prefix)
+        if not os.path.isfile(npy_file) and os.path.isfile(container_file):
+            import h5py
+            return h5py.File(container_file,'r')[field]
+        return np.load(npy_file,mmap_mode='r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        # Closes the container files of cases read from containers (memory-mapped .npy files close when unreferenced).
+        for array in self.arrays:
+            if not isinstance(array,np.ndarray):
+                array.file.close()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,index):
+        if isinstance(index,(int,np.integer)):
+            if not -len(self) <= index < len(self):
+                raise IndexError(f'[dataFoam] Index {index} is out of range for {len(self)} rows')
+            if index < 0:
+                index += len(self)
+            case = np.searchsorted(self.offsets,index,side='right')-1
+            return np.asarray(self.arrays[case][index-self.offsets[case]])
+        if isinstance(index,slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self.get_range(start,stop)
+            index = np.arange(start,stop,step)
+        index = np.asarray(index)
+        if index.dtype == bool:
+            if index.shape != (len(self),):
+                raise IndexError(f'[dataFoam] Boolean index of shape {index.shape} does not match {len(self)} rows')
+            index = np.flatnonzero(index)
+        return self.get_rows(index)
+
+    def get_range(self,start,stop):
+        # Contiguous rows [start, stop), copied case by case.
+        output = np.empty((max(stop-start,0),)+self.shape[1:],dtype=self.dtype)
+        for case, array in enumerate(self.arrays):
+            case_start, case_stop = max(start,self.offsets[case]), min(stop,self.offsets[case+1])
+            if case_start < case_stop:
+                output[case_start-start:case_stop-start] = array[case_start-self.offsets[case]:case_stop-self.offsets[case]]
+        return output
+
+    def get_rows(self,index):
+        # Arbitrary rows, gathered case by case in sorted order (good locality for memory maps, required by h5py).
+        if len(index) > 0 and (index.min() < -len(self) or index.max() >= len(self)):
+            raise IndexError(f'[dataFoam] Indices must be in [{-len(self)}, {len(self)}) for {len(self)} rows')
+        index = np.where(index < 0,index+len(self),index)
+        output = np.empty((len(index),)+self.shape[1:],dtype=self.dtype)
+        cases = np.searchsorted(self.offsets,index,side='right')-1
+        for case in np.unique(cases):
+            positions = np.flatnonzero(cases == case)
+            rows, inverse = np.unique(index[positions]-self.offsets[case],return_inverse=True)
+            output[positions] = self.arrays[case][rows][inverse]
+        return output
+
+    def iterate_batches(self,batch_size,shuffle=False,seed=None):
+        # Yields the rows in batches of batch_size (the last batch may be smaller).
+        for batch in iterate_batch_indices(len(self),batch_size,shuffle,seed):
+            yield self[batch]
+
+def iterate_batch_indices(length,batch_size,shuffle=False,seed=None):
+    # Yields slices (in order) or sorted random index arrays (shuffled) covering range(length) once.
+    if not shuffle:
+        for start in range(0,length,batch_size):
+            yield slice(start,min(start+batch_size,length))
+        return
+    permutation = np.random.default_rng(seed).permutation(length)
+    for start in range(0,length,batch_size):
+        yield np.sort(permutation[start:start+batch_size])
+
+def iterate_minibatches(datasets,batch_size,shuffle=True,seed=None):
+    # Yields tuples of matching batches from several LazyDatasets over the same cases, e.g. (features, targets).
+    length = len(datasets[0])
+    if any(len(dataset) != length for dataset in datasets):
+        raise ValueError('[dataFoam] All datasets must have the same number of rows to be batched together')
+    for batch in iterate_batch_indices(length,batch_size,shuffle,seed):
+        yield tuple(dataset[batch] for dataset in datasets)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-file (HDF5) per-case dataset container, as an alternative to one {dataset_prefix}_{field}.npy file per field.
+Each field is a chunked, optionally compressed dataset in {dataset_prefix}.h5, with its field type as an attribute.
+The file attributes hold the case metadata (case_type, case_name, ...) and a json index of the fields.
+Requires h5py, which is only imported when a container is used.
+"""
+import os
+import json
+
+# Rows per chunk. Chunks span all trailing dimensions, so reading a subset of rows reads whole cells.
+CHUNK_ROWS = 65536
+
+def get_container_file(data_save_path,dataset_prefix):
+    return os.path.join(data_save_path,dataset_prefix+'.h5')
+
+def get_container_field_type(field):
+    # Field type stored in the metadata index, from the number of dimensions of the saved array.
+    return {1: 'scalar', 2: 'vector', 3: 'tensor'}.get(field.ndim,'array')
+
+class FoamDatasetContainer:
+    """
+    Reader/writer for a per-case container file. Fields are only read when accessed:
+        with FoamDatasetContainer(file) as container:
+            container.fields            # field names in the container
+            container.index['U']        # {'field_type', 'shape', 'dtype'}
+            U = container['U'][1000:2000] # reads only the chunks containing these rows
+            data = container.load(['U','k'])
+    """
+
+    def __init__(self,container_file,mode='r',compression=None):
+        """mode: 'r' to read, 'a' to add/replace fields in a new or existing container.
+        compression: None, 'gzip' or 'lzf', used for fields written by write_field.
+        """
+        import h5py
+        self.container_file = container_file
+        self.file = h5py.File(container_file,mode)
+        self.compression = compression
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def fields(self):
+        return list(self.index)
+
+    @property
+    def index(self):
+        return json.loads(self.file.attrs.get('index','{}'))
+
+    @property
+    def metadata(self):
+        return {key: value for key, value in self.file.attrs.items() if key != 'index'}
+
+    def __contains__(self,field):
+        return field in self.file
+
+    def __getitem__(self,field):
+        # Returns the lazy h5py dataset, which supports numpy-style slicing.
+        return self.file[field]
+
+    def load(self,fields=None):
+        # Returns {field: numpy array} for fields (all fields by default).
+        return {field: self.file[field][()] for field in (self.fields if fields is None else fields)}
+
+    def set_metadata(self,**metadata):
+        for key, value in metadata.items():
+            self.file.attrs[key] = value
+
+    def write_field(self,field_name,field):
+        # Adds (or replaces) a field, and its entry in the metadata index.
+        if field_name in self.file:
+            del self.file[field_name]
+        chunks = (min(len(field),CHUNK_ROWS),)+field.shape[1:] if field.ndim > 0 and len(field) > 0 else None
+        dataset = self.file.create_dataset(field_name,data=field,chunks=chunks,compression=self.compression)
+        dataset.attrs['field_type'] = get_container_field_type(field)
+        index = self.index
+        index[field_name] = {'field_type': get_container_field_type(field), 'shape': list(field.shape), 'dtype': str(field.dtype)}
+        self.file.attrs['index'] = json.dumps(index)
+
+def load_container_fields(container_file,fields=None):
+    # Returns {field: numpy array} for a subset of fields (all fields by default) of a container.
+    with FoamDatasetContainer(container_file) as container:
+        return container.load(fields)
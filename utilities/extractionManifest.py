@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Manifest of extracted outputs and the source files they were made from, used for incremental extraction.
+Each manifest entry is {'sources': {source_file: signature}, 'output': output_path, ...}, and a signature is
+{'size', 'mtime', 'hash'} of a source file. Files are only hashed when their size or mtime has changed.
+"""
+import os
+import json
+import hashlib
+
+def load_manifest(manifest_file):
+    # Returns the manifest dict, or an empty dict if there is no (readable) manifest yet.
+    try:
+        with open(manifest_file) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest_file,manifest):
+    # Writes the manifest atomically, so an interrupted run never leaves a corrupt manifest behind.
+    with open(manifest_file+'.tmp','w') as file:
+        json.dump(manifest,file,indent=4)
+    os.replace(manifest_file+'.tmp',manifest_file)
+
+def get_file_hash(file,chunk_size=1<<24):
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size),b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def get_file_signature(file,previous=None):
+    # Returns the signature of file. If previous has the same size and mtime, its hash is reused without reading the file.
+    stat = os.stat(file)
+    if previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': get_file_hash(file)}
+
+def get_sources_signature(sources,entry=None):
+    # Returns {source: signature} for a list of source files, reusing hashes from a previous manifest entry where possible.
+    previous = entry['sources'] if entry is not None else {}
+    return {source: get_file_signature(source,previous.get(source)) for source in sources}
+
+def is_up_to_date(entry,signatures,output):
+    # True if the entry was made from sources with the same contents, and its output still exists.
+    if entry is None or entry.get('output') != output or not os.path.exists(output):
+        return False
+    if set(entry['sources']) != set(signatures):
+        return False
+    return all(entry['sources'][source]['hash'] == signature['hash'] for source, signature in signatures.items())
+
+def get_directory_files(directories):
+    # Returns the sorted list of files under each of directories (which may not exist).
+    files = []
+    for directory in directories:
+        for root, dirs, filenames in os.walk(directory):
+            files += [os.path.join(root,filename) for filename in filenames]
+    return sorted(files)
@@ -8,18 +8,195 @@ Created on Fri Oct 22 17:25:35 2021
 import numpy as np
 import os
 import re
-import Ofpp
+import gzip
+from concurrent.futures import ProcessPoolExecutor
 
-def readFoamField(file):
-    field = Ofpp.parse_internal_field(file)
-    if isinstance(field, float):
-        return field
-    elif field.ndim > 1: 
+# Number of components stored per entry for each OpenFOAM List<type>
+FOAM_LIST_COMPONENTS = {b'scalar': 1, b'vector': 3, b'symmTensor': 6, b'tensor': 9}
+INTERNAL_FIELD_HEADER_REGEX = re.compile(rb'^\s*internalField\s+(?:nonuniform\s+List<(\w+)>\s*(\d+)\s*|uniform\s+([^;]*);)', re.M)
+FORMAT_REGEX = re.compile(rb'^\s*format\s+(\w+)\s*;', re.M)
+ARCH_REGEX = re.compile(rb'^\s*arch\s+"([^"]*)"', re.M)
+CLASS_REGEX = re.compile(rb'^\s*class\s+(\w+)\s*;', re.M)
+PROCESSOR_DIRECTORY_REGEX = re.compile(r'^processor(\d+)$')
+TIME_NAME_REGEX = re.compile(r'^[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$')
+LIST_COUNT_REGEX = re.compile(rb'(?:\s+|//[^\n]*)*(\d+)\s*')
+PARENTHESES_TO_SPACES = bytes.maketrans(b'()', b'  ')
+
+# Relative tolerance when selecting times by value
+TIME_TOLERANCE = 1E-9
+
+cell_proc_addressing_cache = {}
+time_index_cache = {}
+
+def readFoamField(file,workers=1,return_uniform=False):
+    # Reads a foam field file. A field of a decomposed case that has not been reconstructed is read from the processor directories,
+    # with workers processes (see parse_decomposed_internal_field).
+    # return_uniform: also return whether the field is uniform, i.e. a single value (float, or 1D vector/tensor value) rather than a value per cell.
+    field, uniform = parse_internal_field(file,workers,return_uniform=True)
+    if not isinstance(field, float) and field.ndim > 1:
         if field.shape[1] == 6:
             field = reshape_symmTensor(field)
         elif field.shape[1] == 9:
             field = reshape_tensor(field)
-    return field
+    return (field, uniform) if return_uniform else field
+
+def parse_internal_field(file,workers=1,return_uniform=False):
+    # Returns the internalField of a foam field file. Uniform fields are returned as a float (scalar) or a 1D array,
+    # nonuniform fields as an (N,) or (N,components) array. return_uniform: also return whether the field is uniform.
+    # If file (case/time/field) has not been reconstructed, the field is read from the processor directories (see parse_decomposed_internal_field).
+    processor_files = get_decomposed_field_files(file)
+    if processor_files is not None:
+        return parse_decomposed_internal_field(processor_files,workers,return_uniform)
+    content = read_foam_file(file)
+    field = parse_internal_field_content(content,file)
+    return (field, is_uniform_content(content)) if return_uniform else field
+
+def is_uniform_content(content):
+    # Returns True if the internalField of a foam file's content is uniform.
+    header = INTERNAL_FIELD_HEADER_REGEX.search(content)
+    return header is not None and header.group(3) is not None
+
+def get_processor_directories(foam_directory):
+    # Returns the processorN directories of a decomposed case, sorted by N (an empty list for a case that is not decomposed).
+    try:
+        folders_list = next(os.walk(foam_directory))[1]
+    except StopIteration:
+        return []
+    processors = [folder for folder in folders_list if PROCESSOR_DIRECTORY_REGEX.match(folder)]
+    return [os.path.join(foam_directory,folder) for folder in sorted(processors,key=lambda folder: int(folder[len('processor'):]))]
+
+def get_decomposed_field_files(file):
+    # For file = case/time/field, returns the [case/processorN/time/field] files if file itself does not exist
+    # and every processor has the field, otherwise None.
+    if os.path.isfile(find_foam_file(file)):
+        return None
+    time_directory, field = os.path.split(os.path.normpath(file))
+    foam_directory, time = os.path.split(time_directory)
+    processor_files = [os.path.join(processor,time,field) for processor in get_processor_directories(foam_directory)]
+    if not processor_files or not all(os.path.isfile(find_foam_file(processor_file)) for processor_file in processor_files):
+        return None
+    return processor_files
+
+def read_cell_proc_addressing(processor_directory):
+    # Returns the global cell index of each local cell of a processor directory (constant/polyMesh/cellProcAddressing),
+    # cached on the file's modification time since every field of the processor uses it.
+    addressing_file = find_foam_file(os.path.join(processor_directory,'constant','polyMesh','cellProcAddressing'))
+    key = (os.path.abspath(addressing_file),os.stat(addressing_file).st_mtime_ns)
+    if key not in cell_proc_addressing_cache:
+        cell_proc_addressing_cache[key] = read_foam_mesh_list(addressing_file,label=True)
+    return cell_proc_addressing_cache[key]
+
+def parse_processor_internal_field(processor_file):
+    # Returns the internalField of processorN/time/field, whether it is uniform, and the cellProcAddressing of processorN.
+    # Module level so it can run in a process pool.
+    content = read_foam_file(processor_file)
+    return parse_internal_field_content(content,processor_file), is_uniform_content(content), read_cell_proc_addressing(os.path.dirname(os.path.dirname(processor_file)))
+
+def parse_decomposed_internal_field(processor_files,workers=1,return_uniform=False):
+    """Reads the internalField of a field from each processor (ascii or binary) and places each processor's cells at their
+    cellProcAddressing indices, giving the field in the cell order of the reconstructed case.
+    workers: processes reading processor files in parallel. A field that is uniform with the same value on every processor is returned as uniform.
+    return_uniform: also return whether the returned field is uniform.
+    Nothing is printed, since this runs in the worker processes of saveDataset/saveTimeSeries, which log decomposed reads themselves.
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_processor_internal_field,processor_files,chunksize=max(1,len(processor_files)//(4*workers))))
+    else:
+        results = [parse_processor_internal_field(processor_file) for processor_file in processor_files]
+    if all(uniform and np.array_equal(field,results[0][0]) for field, uniform, _ in results):
+        return (results[0][0], True) if return_uniform else results[0][0]
+    # Per-cell shape from a nonuniform processor field, or the uniform value if every processor is uniform (with different values).
+    # Uniform values are broadcast to their processor's cells.
+    shape = next((field.shape[1:] for field, uniform, _ in results if not uniform),np.shape(results[0][0]))
+    global_field = np.empty((sum(len(addressing) for _, _, addressing in results),)+shape)
+    for processor_file, (field, uniform, addressing) in zip(processor_files,results):
+        if not uniform and len(field) != len(addressing):
+            raise ValueError(f'[dataFoam] {processor_file} has {len(field)} cells, but cellProcAddressing has {len(addressing)}')
+        global_field[addressing] = field
+    return (global_field, False) if return_uniform else global_field
+
+def find_foam_file(file):
+    # Returns file, or file.gz if only the compressed version (writeCompression on) exists.
+    if not os.path.isfile(file) and os.path.isfile(file+'.gz'):
+        return file+'.gz'
+    return file
+
+def read_foam_file(file):
+    # Returns the raw bytes of a foam file. Compressed files (writeCompression on) are decompressed transparently,
+    # and file may be given with or without the .gz extension.
+    file = find_foam_file(file)
+    if file.endswith('.gz'):
+        with gzip.open(file,'rb') as f:
+            return f.read()
+    with open(file,'rb') as f:
+        return f.read()
+
+def is_binary_format(content):
+    # Returns True if the FoamFile header declares format binary.
+    header_format = FORMAT_REGEX.search(content,0,content.find(b'}'))
+    return header_format is not None and header_format.group(1) == b'binary'
+
+def get_binary_dtypes(content):
+    # Returns the (scalar, label) numpy dtypes of a binary foam file from the arch entry, e.g. "LSB;label=32;scalar=64".
+    arch = ARCH_REGEX.search(content,0,content.find(b'}'))
+    arch = arch.group(1).decode() if arch is not None else ''
+    byteorder = '>' if 'MSB' in arch else '<'
+    scalar_bits = re.search(r'scalar=(\d+)',arch)
+    label_bits = re.search(r'label=(\d+)',arch)
+    scalar_dtype = np.dtype(byteorder+'f'+str(int(scalar_bits.group(1))//8 if scalar_bits else 8))
+    label_dtype = np.dtype(byteorder+'i'+str(int(label_bits.group(1))//8 if label_bits else 4))
+    return scalar_dtype, label_dtype
+
+def parse_internal_field_content(content,file=''):
+    # Locates the internalField entry by byte offset and converts the whole list in one pass.
+    header = INTERNAL_FIELD_HEADER_REGEX.search(content)
+    if header is None:
+        raise LookupError('[dataFoam] Could not find internalField in '+file)
+    list_type, count, uniform_value = header.groups()
+    if uniform_value is not None:
+        return parse_uniform_value(uniform_value)
+    if list_type not in FOAM_LIST_COMPONENTS:
+        raise ValueError('[dataFoam] Unsupported internalField type List<'+list_type.decode()+'> in '+file)
+    if is_binary_format(content):
+        scalar_dtype, _ = get_binary_dtypes(content)
+        return parse_binary_list(content,header.end(),int(count),FOAM_LIST_COMPONENTS[list_type],scalar_dtype,file)
+    return parse_ascii_list(content,header.end(),int(count),FOAM_LIST_COMPONENTS[list_type],file)
+
+def parse_uniform_value(value):
+    # Returns a float for a uniform scalar, or a 1D array for a uniform vector/tensor.
+    if b'(' in value:
+        return np.fromstring(value.translate(PARENTHESES_TO_SPACES),sep=' ')
+    return float(value)
+
+def parse_ascii_list(content,start,count,components,file=''):
+    # Converts an ascii list starting at byte offset start, e.g. "(\n(1 2 3)\n(4 5 6)\n)" or the compact "{0}" form.
+    if content[start:start+1] == b'{':
+        value = parse_uniform_value(content[start+1:content.index(b'}',start)])
+        return np.tile(value,(count,1)) if components > 1 else np.full(count,value)
+    end = content.index(b';',start)
+    block = content[start+1:content.rindex(b')',start,end)].translate(PARENTHESES_TO_SPACES)
+    data = np.fromstring(block,sep=' ') if count > 0 else np.empty(0)
+    if data.size != count*components:
+        raise ValueError(f'[dataFoam] Expected {count*components} values in internalField of {file}, found {data.size}')
+    if components > 1:
+        data = data.reshape((count,components))
+    return data
+
+def parse_binary_list(content,start,count,components,dtype,file=''):
+    # Reads a binary list starting at byte offset start, "(" followed by count*components raw values and ")".
+    # The returned array is a read-only view of content when no byte swapping or conversion is needed.
+    if content[start:start+1] == b'{':
+        value = np.frombuffer(content,dtype=dtype,count=components,offset=start+1).astype(np.float64)
+        return np.tile(value,(count,1)) if components > 1 else np.full(count,value[0])
+    if content[start:start+1] != b'(' or start+1+count*components*dtype.itemsize > len(content):
+        raise ValueError('[dataFoam] Could not read binary internalField of '+file)
+    data = np.frombuffer(content,dtype=dtype,count=count*components,offset=start+1)
+    if data.dtype != np.float64:
+        data = data.astype(np.float64)
+    if components > 1:
+        data = data.reshape((count,components))
+    return data
 
 def reshape_symmTensor(Tensor):
     Tensor = np.stack((Tensor[:,0], Tensor[:,1], Tensor[:,2], Tensor[:,1], Tensor[:,3], Tensor[:,4], Tensor[:,2], Tensor[:,4],Tensor[:,5]),axis=1)
@@ -33,45 +210,217 @@ def reshape_tensor(Tensor):
 def get_cell_count(foam_directory):
     # Returns scalar number of cells for the case at foam_directory.
     # Uses a trick to read a specific part of the polyMesh/neighbour file.
+    # Only the FoamFile header is searched, so this also works for binary and compressed meshes.
     try: 
-        with open(os.path.join(foam_directory,'constant','polyMesh','neighbour')) as file:
-            lines = file.readlines()
-            for line in lines:
-                if re.search(r'\s* note',line):
-                    cells = int(re.search(r'nCells:(.+?) ',line).group(1))
-                    break
+        content = read_foam_file(os.path.join(foam_directory,'constant','polyMesh','neighbour'))
+        cells = int(re.search(rb'nCells:\s*(\d+)',content[:content.find(b'}')]).group(1))
         print('[dataFoam] Found a mesh with number of cells: '+str(cells))
     except:
         raise LookupError('[dataFoam] Could not find a mesh for the foam case '+foam_directory)
     return cells
 
+def get_time_index(foam_directory):
+    """Returns [(time, time name)] for the time directories of a case, sorted by time. Time names are parsed as floats (0.005, 1e-05, 20000),
+    and directories whose names are not numbers (constant, system, processor*, postProcessing...) are ignored.
+    The times of processor0 are included, for a decomposed case that has not been reconstructed.
+    Cached on the modification times of the case (and processor0) directories, which change when a time directory is added or removed.
+    """
+    directories = [directory for directory in [foam_directory,os.path.join(foam_directory,'processor0')] if os.path.isdir(directory)]
+    if not directories:
+        raise LookupError('[dataFoam] Could not find the foam case '+foam_directory)
+    key = tuple((os.path.abspath(directory),os.stat(directory).st_mtime_ns) for directory in directories)
+    if key not in time_index_cache:
+        times = {}
+        for directory in reversed(directories): # names in the case directory take precedence over processor0
+            times.update({float(name): name for name in next(os.walk(directory))[1] if TIME_NAME_REGEX.match(name)})
+        time_index_cache[key] = sorted(times.items())
+    return time_index_cache[key]
+
+def select_times(foam_directory,time='latestTime'):
+    """Returns the names of the time directories of a case selected by time, in time order:
+    'latestTime', 'all', a time (a number, or a time name such as '1e-05'), a 'start:end' range (either end may be left empty, as in the -time option
+    of OpenFOAM applications) or a (start, end) tuple. Ranges include their ends.
+    """
+    time_index = get_time_index(foam_directory)
+    if time == 'latestTime':
+        selected = time_index[-1:]
+    elif time == 'all':
+        selected = time_index
+    else:
+        if isinstance(time,str) and ':' in time:
+            start, end = [float(value) if value.strip() else default for value, default in zip(time.split(':'),[-np.inf,np.inf])]
+        elif isinstance(time,(tuple,list)):
+            start, end = float(time[0]), float(time[1])
+        else:
+            start = end = float(time)
+        # Tolerance for times given with fewer digits than the time names
+        tolerance = TIME_TOLERANCE*max(abs(start) if np.isfinite(start) else 0,abs(end) if np.isfinite(end) else 0,1)
+        selected = [(value, name) for value, name in time_index if start-tolerance <= value <= end+tolerance]
+    if not selected:
+        raise LookupError(f'[dataFoam] No time directories matching {time} in the foam case {foam_directory}')
+    return [name for _, name in selected]
+
 def get_endtime(foam_directory):
-    # Returns the largest reconstructed time step as an int for a foam_directory.
-    try: 
-        folders_list = next(os.walk(foam_directory))[1]
-        endtime=0
-        folders_list = [ x for x in folders_list if "processor" not in x ]
-        for folder in folders_list:
-            x = re.findall("\\d", folder)
-            result = "".join(x)
-            if result != '':
-                if int(result) > endtime:
-                    endtime=int(result)
-                
-        print('[dataFoam] Found endtime: '+ str(endtime))
-    except: 
-        raise LookupError('[dataFoam] Could not get endtime for the foam case '+foam_directory)
+    # Returns the name of the latest time directory (reconstructed, or in processor0 for a decomposed case) of a foam_directory.
+    endtime = select_times(foam_directory,'latestTime')[-1]
+    print('[dataFoam] Found endtime: '+ endtime)
     return endtime
 
 def get_cell_centres(foam_directory):
-    # Returns three vectors, Cx, Cy, Cz. Runs writeCellCentres then reads the files.
-    logfile = os.path.join(foam_directory,'log.writeCellCentres')
-    print(f'[dataFoam] Running writeCellCentres....')
-    os.system(f'postProcess -case {foam_directory} -func writeCellCentres > {logfile}')
-    cell_centres = readFoamField(os.path.join(foam_directory,'0/C'))
+    # Returns the (N,3) cell centres, computed from constant/polyMesh.
+    cell_centres, _ = get_cell_centres_volumes(foam_directory)
     #Cx, Cy, Cz = cell_centres[:,0], cell_centres[:,1], cell_centres[:,2]  
     return cell_centres
-    
+
+def get_cell_centres_volumes(foam_directory):
+    # Returns the (N,3) cell centres and (N,) cell volumes, computed directly from constant/polyMesh
+    # (same decomposition as OpenFOAM's primitiveMesh), so the OpenFOAM runtime is not needed.
+    # A decomposed case without the undecomposed mesh is stitched together from the processor meshes (see get_decomposed_cell_centres_volumes).
+    processors = get_processor_directories(foam_directory)
+    if processors and not os.path.isfile(find_foam_file(os.path.join(foam_directory,'constant','polyMesh','owner'))):
+        return get_decomposed_cell_centres_volumes(processors)
+    print(f'[dataFoam] Calculating cell centres and volumes from polyMesh....')
+    points, face_offsets, face_labels, owner, neighbour = read_polyMesh(foam_directory)
+    face_centres, face_areas = calc_face_centres_areas(points,face_offsets,face_labels)
+    return calc_cell_centres_volumes(face_centres,face_areas,owner,neighbour)
+
+def get_decomposed_cell_centres_volumes(processor_directories):
+    # Returns the cell centres and volumes of each processor mesh, placed at their cellProcAddressing indices.
+    print(f'[dataFoam] Calculating cell centres and volumes from {len(processor_directories)} processor meshes....')
+    addressing = [read_cell_proc_addressing(processor) for processor in processor_directories]
+    n_cells = sum(len(cells) for cells in addressing)
+    cell_centres, cell_volumes = np.empty((n_cells,3)), np.empty(n_cells)
+    for processor, cells in zip(processor_directories,addressing):
+        points, face_offsets, face_labels, owner, neighbour = read_polyMesh(processor)
+        face_centres, face_areas = calc_face_centres_areas(points,face_offsets,face_labels)
+        cell_centres[cells], cell_volumes[cells] = calc_cell_centres_volumes(face_centres,face_areas,owner,neighbour)
+    return cell_centres, cell_volumes
+
+def read_polyMesh(foam_directory):
+    # Returns points (nPoints,3), faces as offsets (nFaces+1,) into a flat labels array, owner and neighbour.
+    mesh_directory = os.path.join(foam_directory,'constant','polyMesh')
+    points = read_foam_mesh_list(os.path.join(mesh_directory,'points'),components=3)
+    face_offsets, face_labels = read_foam_faces(os.path.join(mesh_directory,'faces'))
+    owner = read_foam_mesh_list(os.path.join(mesh_directory,'owner'),label=True)
+    neighbour = read_foam_mesh_list(os.path.join(mesh_directory,'neighbour'),label=True)
+    return points, face_offsets, face_labels, owner, neighbour
+
+def find_list_start(content,pos):
+    # Returns (count, offset of the opening bracket) for the next list at or after pos, skipping // comments.
+    list_count = LIST_COUNT_REGEX.match(content,pos)
+    if list_count is None:
+        raise ValueError('[dataFoam] Could not find a list in foam file')
+    return int(list_count.group(1)), list_count.end()
+
+def find_body_start(content):
+    # Returns the offset just after the FoamFile header dictionary.
+    return content.index(b'}',content.index(b'FoamFile'))+1
+
+def read_foam_mesh_list(file,components=1,label=False):
+    # Reads a polyMesh list file (points, owner, neighbour, cellProcAddressing...), ascii or binary.
+    content = read_foam_file(file)
+    count, start = find_list_start(content,find_body_start(content))
+    data, _ = parse_mesh_list(content,start,count,components,label,file)
+    return data
+
+def parse_mesh_list(content,start,count,components,label,file=''):
+    # Returns the list starting at byte offset start, and the offset just after its closing bracket.
+    if is_binary_format(content):
+        scalar_dtype, label_dtype = get_binary_dtypes(content)
+        dtype = label_dtype if label else scalar_dtype
+        if content[start:start+1] == b'{':
+            data = np.frombuffer(content,dtype=dtype,count=components,offset=start+1)
+            return np.tile(data,(count,1)) if components > 1 else np.full(count,data[0]), start+2+components*dtype.itemsize
+        end = start+1+count*components*dtype.itemsize
+        data = np.frombuffer(content,dtype=dtype,count=count*components,offset=start+1)
+        data = data.astype(np.int64 if label else np.float64)
+    else:
+        if content[start:start+1] == b'{':
+            close = content.index(b'}',start)
+            value = parse_uniform_value(content[start+1:close])
+            data = np.tile(value,(count,1)) if components > 1 else np.full(count,value)
+            return data.astype(np.int64) if label else data, close+1
+        # Flat lists close at the first bracket, nested lists (one per file in polyMesh) at the last one.
+        end = content.index(b')',start) if components == 1 else content.rindex(b')')
+        block = content[start+1:end].translate(PARENTHESES_TO_SPACES)
+        data = np.fromstring(block,dtype=np.int64 if label else np.float64,sep=' ') if count > 0 else np.empty(0,dtype=np.int64 if label else np.float64)
+    if data.size != count*components:
+        raise ValueError(f'[dataFoam] Expected {count*components} values in {file}, found {data.size}')
+    if components > 1:
+        data = data.reshape((count,components))
+    return data, end+1
+
+def read_foam_faces(file):
+    # Returns (offsets, labels) for a faceList or faceCompactList file, ascii or binary.
+    # Face i has the point labels labels[offsets[i]:offsets[i+1]].
+    content = read_foam_file(file)
+    foam_class = CLASS_REGEX.search(content,0,find_body_start(content))
+    count, start = find_list_start(content,find_body_start(content))
+    if foam_class is not None and foam_class.group(1) == b'faceCompactList':
+        offsets, end = parse_mesh_list(content,start,count,1,True,file)
+        count, start = find_list_start(content,end)
+        labels, _ = parse_mesh_list(content,start,count,1,True,file)
+        return offsets, labels
+    if is_binary_format(content):
+        raise ValueError('[dataFoam] Binary faces must be written as a faceCompactList: '+file)
+    # ascii faceList, e.g. "4(0 1 2 3)": face sizes are the numbers directly followed by an opening bracket.
+    block = content[start+1:content.rindex(b')')]
+    tokens = np.fromstring(block.translate(PARENTHESES_TO_SPACES),dtype=np.int64,sep=' ')
+    characters = np.frombuffer(block,dtype=np.uint8)
+    is_digit = (characters >= ord('0')) & (characters <= ord('9'))
+    token_starts = np.flatnonzero(is_digit & ~np.concatenate(([False],is_digit[:-1])))
+    size_tokens = np.searchsorted(token_starts,np.flatnonzero(characters == ord('(')))-1
+    is_label = np.ones(len(tokens),dtype=bool)
+    is_label[size_tokens] = False
+    sizes, labels = tokens[size_tokens], tokens[is_label]
+    if len(sizes) != count or labels.size != sizes.sum():
+        raise ValueError('[dataFoam] Could not read the faces in '+file)
+    offsets = np.concatenate(([0],np.cumsum(sizes)))
+    return offsets, labels
+
+def calc_face_centres_areas(points,face_offsets,face_labels):
+    # Face centres and area vectors, by splitting each face into triangles about its point average.
+    n_faces = len(face_offsets)-1
+    sizes = np.diff(face_offsets)
+    face_of_point = np.repeat(np.arange(n_faces),sizes)
+    face_points = points[face_labels]
+    point_average = np.stack([np.bincount(face_of_point,weights=face_points[:,i],minlength=n_faces) for i in range(3)],axis=1)/sizes[:,None]
+    # Next point around each face, wrapping the last point back to the first
+    next_index = np.arange(len(face_labels))+1
+    next_index[face_offsets[1:]-1] = face_offsets[:-1]
+    next_points = face_points[next_index]
+    centre_estimate = point_average[face_of_point]
+    triangle_normals = np.cross(next_points-face_points,centre_estimate-face_points)
+    triangle_areas = np.linalg.norm(triangle_normals,axis=1)
+    triangle_centres = face_points+next_points+centre_estimate
+    sum_area = np.bincount(face_of_point,weights=triangle_areas,minlength=n_faces)
+    face_areas = 0.5*np.stack([np.bincount(face_of_point,weights=triangle_normals[:,i],minlength=n_faces) for i in range(3)],axis=1)
+    face_centres = np.stack([np.bincount(face_of_point,weights=triangle_areas*triangle_centres[:,i],minlength=n_faces) for i in range(3)],axis=1)
+    # Degenerate faces fall back to the point average
+    degenerate = sum_area < 1E-300
+    face_centres[~degenerate] /= 3.0*sum_area[~degenerate,None]
+    face_centres[degenerate] = point_average[degenerate]
+    return face_centres, face_areas
+
+def calc_cell_centres_volumes(face_centres,face_areas,owner,neighbour):
+    # Cell centres and volumes, by decomposing each cell into pyramids on its faces about the average face centre.
+    n_cells = int(max(owner.max(),neighbour.max() if len(neighbour) else 0))+1
+    n_internal = len(neighbour)
+    cell_faces = np.concatenate((owner,neighbour))
+    faces = np.concatenate((np.arange(len(owner)),np.arange(n_internal)))
+    n_cell_faces = np.bincount(cell_faces,minlength=n_cells)
+    centre_estimate = np.stack([np.bincount(cell_faces,weights=face_centres[faces,i],minlength=n_cells) for i in range(3)],axis=1)/n_cell_faces[:,None]
+    # 3*pyramid volume, positive for owner cells and negative for neighbour cells
+    pyramid_volumes = np.einsum('ij,ij->i',face_areas[faces],face_centres[faces]-centre_estimate[cell_faces])
+    pyramid_volumes[len(owner):] *= -1
+    pyramid_centres = 0.75*face_centres[faces]+0.25*centre_estimate[cell_faces]
+    cell_volumes = np.bincount(cell_faces,weights=pyramid_volumes,minlength=n_cells)
+    cell_centres = np.stack([np.bincount(cell_faces,weights=pyramid_volumes*pyramid_centres[:,i],minlength=n_cells) for i in range(3)],axis=1)
+    valid = np.abs(cell_volumes) > 1E-300
+    cell_centres[valid] /= cell_volumes[valid,None]
+    cell_centres[~valid] = centre_estimate[~valid]
+    return cell_centres, cell_volumes/3.0
+
 def readLineofFile(file,line):
     # Returns a line of a file.
     a_file = open(file)
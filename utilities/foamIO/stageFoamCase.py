@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+
+def stageFoamCase(foam_dir,stage_dir,time_name,copied_files=('system/controlDict',)):
+    # Creates a lightweight working copy of foam_dir in stage_dir, containing only constant/, system/ and the time_name directory.
+    # Files in constant/ and system/ are symlinked, except copied_files (dictionaries that are edited, e.g. by changeFoamSystemDictEntry)
+    # and polyMesh/sets (written by checkMesh). The time directory is copied, since the writeFields applications
+    # rewrite existing fields in it (e.g. k in writeFields_DNS), which would write through a link into foam_dir.
+    # Every other time step, processor* and postProcessing directory is skipped.
+    start_time = time.perf_counter()
+    if not os.path.isdir(os.path.join(foam_dir,time_name)):
+        raise LookupError(f'[dataFoam] Time directory {time_name} not found in {foam_dir}, reconstruct decomposed cases before staging them')
+    if os.path.isdir(stage_dir):
+        shutil.rmtree(stage_dir)
+    os.makedirs(stage_dir)
+    foam_dir = os.path.abspath(foam_dir)
+    linked_bytes = 0
+    for subdirectory in ['constant','system']:
+        for root, dirs, files in os.walk(os.path.join(foam_dir,subdirectory)):
+            dirs[:] = [d for d in dirs if d != 'sets']
+            relative_root = os.path.relpath(root,foam_dir)
+            os.makedirs(os.path.join(stage_dir,relative_root),exist_ok=True)
+            for file in files:
+                relative_file = os.path.join(relative_root,file)
+                if relative_file in copied_files:
+                    shutil.copy2(os.path.join(foam_dir,relative_file),os.path.join(stage_dir,relative_file))
+                else:
+                    os.symlink(os.path.join(foam_dir,relative_file),os.path.join(stage_dir,relative_file))
+                    linked_bytes += os.path.getsize(os.path.join(foam_dir,relative_file))
+    shutil.copytree(os.path.join(foam_dir,time_name),os.path.join(stage_dir,time_name),symlinks=True)
+    stage_time = time.perf_counter()-start_time
+
+    staged_bytes = get_directory_size(stage_dir)
+    case_bytes = get_directory_size(foam_dir)
+    print(f'[dataFoam] Staged {foam_dir} (time {time_name}) in {stage_time:.2f} s: copied {staged_bytes/1E6:.1f} MB, '
+          +f'linked {linked_bytes/1E6:.1f} MB, skipped {(case_bytes-staged_bytes-linked_bytes)/1E6:.1f} MB. '
+          +f'A full copy would write {case_bytes/1E6:.1f} MB ({(case_bytes-staged_bytes)/1E6:.1f} MB saved, '
+          +f'~{stage_time*(case_bytes/max(staged_bytes,1)-1):.2f} s saved at the same copy rate).')
+    return staged_bytes, case_bytes, stage_time
+
+def get_directory_size(directory):
+    # Returns the total size in bytes of the regular files under directory, not following symlinks.
+    size = 0
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            path = os.path.join(root,file)
+            if not os.path.islink(path):
+                size += os.path.getsize(path)
+    return size
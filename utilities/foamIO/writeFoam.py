@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Foam field writing: FoamFieldWriter writes fields of any rank with a boundaryField generated from constant/polyMesh/boundary,
+and the internalField list is written in ascii or binary (see FoamFieldFile).
+Each chunk of cells is formatted with a single %-format of one row template, which gives the same text as
+np.savetxt(fmt='%s') of a string array with '(' and ')' columns, without building a string array first.
+"""
+import os
+import re
+import gzip
+import numpy as np
+from dataFoam.utilities.foamIO.readFoam import read_foam_file, find_foam_file, find_body_start
+
+# Cells formatted (and written) at a time by write_foam_list
+WRITE_CHUNK_CELLS = 100000
+
+def get_foam_list_rows(field):
+    # N x K rows of a scalar (N), vector (N x K) or tensor (N x 3 x 3, written row by row as in OpenFOAM) field
+    field = np.asarray(field)
+    return field.reshape(len(field),-1) if field.ndim > 1 else field
+
+def format_foam_list(field,value_format=None,chunk_cells=WRITE_CHUNK_CELLS):
+    """Yields the text of the list entries of field, chunk_cells rows at a time: one value per line for scalars, '( v1 v2 ... )' otherwise.
+    value_format: %-format of each value, e.g. '%.18e'. The default writes the shortest repr of each value, as str() of a numpy float.
+    """
+    rows = get_foam_list_rows(field)
+    if value_format is None and rows.dtype.kind == 'f' and rows.dtype != np.float64:
+        # repr of the Python float would show float64 digits of e.g. float32 values, so format with numpy instead
+        rows, value_format = rows.astype(str), '%s'
+    if value_format is None:
+        value_format = '%r'
+    row_format = value_format+'\n' if rows.ndim == 1 else '( '+' '.join([value_format]*rows.shape[1])+' )\n'
+    for start in range(0,len(rows),chunk_cells):
+        chunk = rows[start:start+chunk_cells]
+        yield (row_format*len(chunk)) % tuple(chunk.ravel().tolist())
+
+def write_foam_list(file,field,value_format=None,chunk_cells=WRITE_CHUNK_CELLS):
+    # Writes the list entries of field to an open text file (see format_foam_list)
+    for text in format_foam_list(field,value_format,chunk_cells):
+        file.write(text)
+
+# arch entry of binary files written by FoamFieldFile: little-endian, 32 bit labels, 64 bit scalars
+BINARY_ARCH = 'LSB;label=32;scalar=64'
+ASCII_FORMAT_REGEX = re.compile(r'^([ \t]*)format(\s+)ascii;', re.M)
+
+class FoamFieldFile:
+    """
+    Output file of the writeFoam_* functions, which write the FoamFile header and boundaryField as text around the internalField list:
+        file = FoamFieldFile(filename,write_format,write_compression)
+        file.write(header)                  # ends with 'internalField nonuniform List<type>\\n'
+        file.write_list(field,' (\\n')      # count and list entries, followed by the ascii opening for ascii files
+        file.write(');\\nboundaryField ...')
+        file.close()
+    write_format: 'ascii', or 'binary' to switch the header to format binary (with the arch entry) and write the list as raw
+    little-endian doubles straight from the array buffer, as OpenFOAM does with writeFormat binary.
+    write_compression: write filename.gz (as OpenFOAM does with writeCompression on). The uncompressed file is removed, since it would be read instead.
+    """
+
+    def __init__(self,filename,write_format='ascii',write_compression=False):
+        if write_format not in ['ascii','binary']:
+            raise ValueError('[dataFoam] write_format must be ascii or binary, not '+str(write_format))
+        self.binary = write_format == 'binary'
+        stale_file = filename if write_compression else filename+'.gz'
+        if os.path.isfile(stale_file):
+            os.remove(stale_file)
+        self.file = gzip.open(filename+'.gz','wb') if write_compression else open(filename,'wb')
+        self.format_switched = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def write(self,text):
+        if self.binary and not self.format_switched:
+            text, count = ASCII_FORMAT_REGEX.subn(r'\1format\2binary;\n\1arch\2  "'+BINARY_ARCH+'";',text,count=1)
+            self.format_switched = count > 0
+        self.file.write(text.encode())
+
+    def write_list(self,field,ascii_opening=' (\n',value_format=None):
+        """Writes the list count and entries of field, up to (not including) the closing bracket.
+        ascii_opening: text between the count and the first entry of ascii lists (e.g. ' (\\n' or '\\n(\\n'), so ascii output is unchanged.
+        value_format: %-format of ascii values (see format_foam_list).
+        """
+        if not self.binary:
+            self.write(str(len(field))+ascii_opening)
+            write_foam_list(self,field,value_format)
+            return
+        self.write(str(len(field))+'\n(')
+        self.file.write(memoryview(np.ascontiguousarray(get_foam_list_rows(field),dtype='<f8')).cast('B'))
+
+FOAM_BANNER = r"""/*--------------------------------*- C++ -*----------------------------------*\
+| =========                 |                                                 |
+| \\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
+|  \\    /   O peration     | Version:  v2006                                 |
+|   \\  /    A nd           | Website:  www.openfoam.com                      |
+|    \\/     M anipulation  |                                                 |
+\*---------------------------------------------------------------------------*/
+"""
+FOAM_FIELD_HEADER = FOAM_BANNER + """FoamFile
+{{
+    version     2.0;
+    format      ascii;
+    class       {field_class};
+    object      {field_name};
+}}
+// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+
+dimensions      {dimensions};
+
+internalField   nonuniform List<{list_type}>
+"""
+FOAM_FOOTER = "\n// ************************************************************************* //\n"
+
+# List type of N x K fields, and zero values of each list type
+FOAM_LIST_TYPES = {1: 'scalar', 3: 'vector', 6: 'symmTensor', 9: 'tensor'}
+FOAM_ZERO_VALUES = {'scalar': '0', 'vector': '(0 0 0)', 'symmTensor': '(0 0 0 0 0 0)', 'tensor': '(0 0 0 0 0 0 0 0 0)'}
+# Default boundary condition of a written field for each patch type. Constraint patch types (cyclic, empty, symmetry, processor...)
+# must have the boundary condition of the same name, and other patch types default to calculated.
+PATCH_TYPE_BOUNDARY_TYPES = {'wall': 'fixedValue', 'patch': 'zeroGradient'}
+CONSTRAINT_PATCH_TYPES = ['cyclic','cyclicAMI','cyclicACMI','cyclicSlip','empty','nonuniformTransformCyclic','processor','processorCyclic','symmetry','symmetryPlane','wedge']
+# Boundary condition types written with a value entry
+VALUE_BOUNDARY_TYPES = ['calculated','fixedValue','processor','processorCyclic']
+
+boundary_patches_cache = {}
+
+def read_boundary_patches(foam_case_dir):
+    """Returns the [(patch name, patch type)] list of constant/polyMesh/boundary of a foam case.
+    Cached on the file's modification time, so writing many fields to a case reads it once.
+    """
+    boundary_file = find_foam_file(os.path.join(foam_case_dir,'constant','polyMesh','boundary'))
+    key = (os.path.abspath(boundary_file),os.stat(boundary_file).st_mtime_ns)
+    if key not in boundary_patches_cache:
+        content = read_foam_file(boundary_file)
+        body = re.sub(rb'//[^\n]*|/\*.*?\*/',b'',content[find_body_start(content):],flags=re.S).decode()
+        patches = [(name, re.search(r'\btype\s+(\w+)\s*;',entry).group(1)) for name, entry in re.findall(r'([^\s(){};]+)\s*\{([^{}]*)\}',body)]
+        if not patches:
+            raise LookupError('[dataFoam] No patches found in '+boundary_file)
+        boundary_patches_cache[key] = patches
+    return boundary_patches_cache[key]
+
+def get_foam_list_type(field):
+    # OpenFOAM list type of a scalar (N), vector (N x 3), symmTensor (N x 6, xx xy xz yy yz zz) or tensor (N x 9 or N x 3 x 3) field
+    components = int(np.prod(np.shape(field)[1:]))
+    if components not in FOAM_LIST_TYPES:
+        raise ValueError(f'[dataFoam] Cannot write a field of shape {np.shape(field)} to foam')
+    return FOAM_LIST_TYPES[components]
+
+class FoamFieldWriter:
+    """
+    Writes volFields of any rank to a foam case, with a boundaryField generated from the case's patches:
+        writer = FoamFieldWriter(foam_case_dir)
+        writer.write_field(os.path.join(foam_case_dir,'0','nut_L'),nut_L,dimensions='[0 2 -1 0 0 0 0]')
+    The boundary condition of each patch is boundary_types[patch name] if given, otherwise the default for its patch type
+    (see PATCH_TYPE_BOUNDARY_TYPES). The boundaryField text is built once per field type and reused for every field of that type,
+    so only the short header is formatted per field.
+    """
+
+    def __init__(self,foam_case_dir=None,patches=None,boundary_types=None):
+        """foam_case_dir: case whose constant/polyMesh/boundary gives the patches.
+        patches: [(patch name, patch type)] to use instead of reading them from foam_case_dir. Patch names may be regular expressions, e.g. '".*"'.
+        boundary_types: {patch name: boundary condition type} overriding the patch type defaults, e.g. {'inlet': 'calculated'}.
+        """
+        self.patches = patches if patches is not None else read_boundary_patches(foam_case_dir)
+        self.boundary_types = boundary_types if boundary_types is not None else {}
+        self.boundary_fields = {}
+
+    def get_boundary_type(self,patch_name,patch_type):
+        if patch_name in self.boundary_types:
+            return self.boundary_types[patch_name]
+        if patch_type in CONSTRAINT_PATCH_TYPES:
+            return patch_type
+        return PATCH_TYPE_BOUNDARY_TYPES.get(patch_type,'calculated')
+
+    def get_boundary_field(self,list_type):
+        entries = []
+        for patch_name, patch_type in self.patches:
+            boundary_type = self.get_boundary_type(patch_name,patch_type)
+            entry = f'    {patch_name}\n    {{\n        type            {boundary_type};\n'
+            if boundary_type in VALUE_BOUNDARY_TYPES:
+                entry += f'        value           uniform {FOAM_ZERO_VALUES[list_type]};\n'
+            entries.append(entry+'    }\n')
+        return 'boundaryField\n{\n'+''.join(entries)+'}\n'
+
+    def get_templates(self,list_type,field_name,dimensions):
+        # (header, footer) text around the internalField list. The footer (with the boundaryField) is cached per list type.
+        if list_type not in self.boundary_fields:
+            self.boundary_fields[list_type] = ')\n;\n\n'+self.get_boundary_field(list_type)+FOAM_FOOTER
+        header = FOAM_FIELD_HEADER.format(field_class='vol'+list_type[0].upper()+list_type[1:]+'Field',field_name=field_name,dimensions=dimensions,list_type=list_type)
+        return header, self.boundary_fields[list_type]
+
+    def write_field(self,filename,field,field_name=None,dimensions='[0 0 0 0 0 0 0]',write_format='ascii',write_compression=False,nan_value=1E10):
+        """Writes field (see get_foam_list_type for the shapes) to filename. field_name defaults to the file name.
+        NaN values are written as nan_value (the array itself is not changed), since OpenFOAM cannot read them.
+        write_format, write_compression: see FoamFieldFile.
+        """
+        field_name = os.path.basename(filename) if field_name is None else field_name
+        print('[dataFoam] Writing {} to file {}'.format(field_name,filename))
+        nan_count = np.count_nonzero(np.isnan(field))
+        if nan_count > 0:
+            print('\n[dataFoam] WARNING! Found '+str(nan_count)+f' NaN values in the field. Replacing these with {nan_value} when writing to foam, but will still be present in saved array.')
+            field = np.nan_to_num(field,copy=True,nan=nan_value)
+        header, footer = self.get_templates(get_foam_list_type(field),field_name,dimensions)
+        with FoamFieldFile(filename,write_format,write_compression) as file:
+            file.write(header)
+            file.write_list(field,'\n(\n')
+            file.write(footer)
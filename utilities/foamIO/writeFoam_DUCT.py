@@ -5,111 +5,17 @@ Created on Fri Oct 22 17:25:35 2021
 
 @author: ryley
 """
-import numpy as np
+from dataFoam.utilities.foamIO.writeFoam import FoamFieldWriter
 
-def writeFoam_U_DUCT(filename, U):
-    # Writes the aperp file
-    cells = len(U)
-    leftbracket = np.repeat('(',cells)
-    rightbracket = np.repeat(')',cells)
-    array_write = np.column_stack((leftbracket,U,rightbracket))
-    print('[dataFoam] Writing U to file '+filename)
-    file = open(filename,'w')
-    file.write("""/*--------------------------------*- C++ -*----------------------------------*\
-| =========                 |                                                 |
-| \\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
-|  \\    /   O peration     | Version:  v2006                                 |
-|   \\  /    A nd           | Website:  www.openfoam.com                      |
-|    \\/     M anipulation  |                                                 |
-\*---------------------------------------------------------------------------*/
-FoamFile
-{
-    version     2.0;
-    format      ascii;
-    class       volVectorField;
-    object      U;
-}
-// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+# Patches of the DUCT cases, for writing without reading the case's polyMesh/boundary
+DUCT_PATCHES = [('inlet','cyclic'),('outlet','cyclic'),('walls','wall')]
+duct_U_writer = FoamFieldWriter(patches=DUCT_PATCHES,boundary_types={'walls': 'noSlip'})
+duct_writer = FoamFieldWriter(patches=DUCT_PATCHES)
 
-dimensions      [0 1 -1 0 0 0 0];
+def writeFoam_U_DUCT(filename, U,write_format='ascii',write_compression=False):
+    # Writes the U file
+    duct_U_writer.write_field(filename,U,'U','[0 1 -1 0 0 0 0]',write_format,write_compression)
 
-internalField nonuniform List<vector>
-""")
-    file.write(str(cells) + """ 
-(
-""")
-    np.savetxt(file, array_write,fmt='%s')
-    file.write(""");
-boundaryField
-{
-    inlet
-    {
-        type            cyclic;
-    }
-
-    outlet
-    {
-        type            cyclic;
-    }
-
-    walls
-    {
-        type            noSlip;
-    }
-}
-// ************************************************************************* //""")
-    file.close()
-
-def writeFoam_TauDNS_DUCT(filename, tau):
+def writeFoam_TauDNS_DUCT(filename, tau,write_format='ascii',write_compression=False):
     # Writes the tau file, assumes tau is column stacked
-    cells = len(tau)
-    leftbracket = np.repeat('(',cells)
-    rightbracket = np.repeat(')',cells)
-    array_write = np.column_stack((leftbracket,tau,rightbracket))
-    print('[dataFoam] Writing tau to file '+filename)
-    file = open(filename,'w')
-    file.write("""/*--------------------------------*- C++ -*----------------------------------*\
-| =========                 |                                                 |
-| \\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
-|  \\    /   O peration     | Version:  v2006                                 |
-|   \\  /    A nd           | Website:  www.openfoam.com                      |
-|    \\/     M anipulation  |                                                 |
-\*---------------------------------------------------------------------------*/
-FoamFile
-{
-    version     2.0;
-    format      ascii;
-    class       volSymmTensorField;
-    object      tau;
-}
-// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
-
-dimensions      [0 2 -2 0 0 0 0];
-
-internalField nonuniform List<symmTensor>
-""")
-    file.write(str(cells) + """
-(
-""")
-    np.savetxt(file, array_write,fmt='%s')
-    file.write(""");
-boundaryField
-{
-    inlet
-    {
-        type            cyclic;
-    }
-
-    outlet
-    {
-        type            cyclic;
-    }
-
-    ".*"
-    {
-        type            fixedValue;
-        value           uniform (0 0 0 0 0 0);
-    }
-}
-    // ************************************************************************* //""")
-    file.close()
+    duct_writer.write_field(filename,tau,'tau','[0 2 -2 0 0 0 0]',write_format,write_compression)
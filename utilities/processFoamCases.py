@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch driver: runs MLDatasetFromFoamCase.writeFields/saveDataset for many cases over a process pool.
+
+Usage: python -m dataFoam.utilities.processFoamCases manifest.csv [--workers N] [--report report.json]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataFoam.utilities.MLDatasetFromFoamCase import MLDatasetFromFoamCase
+
+MANIFEST_COLUMNS = ['data_save_path','foam_parent_dir','case_name','case_type','write_fields_application']
+
+def read_manifest(manifest_file):
+    """Reads a csv manifest, one case per row.
+    Required columns: data_save_path, foam_parent_dir, case_name, case_type, write_fields_application (as in MLDatasetFromFoamCase).
+    Optional columns: dataset_prefix, defaults to {case_type}_{case_name}, stage_method, defaults to copy, and time, defaults to latestTime.
+    """
+    with open(manifest_file,newline='') as file:
+        cases = [dict(row) for row in csv.DictReader(file)]
+    for case in cases:
+        missing = [column for column in MANIFEST_COLUMNS if not case.get(column)]
+        if missing:
+            raise ValueError(f'[dataFoam] Manifest entry {case} is missing {missing}')
+        if not case.get('dataset_prefix'):
+            case['dataset_prefix'] = case['case_type']+'_'+case['case_name']
+        if not case.get('stage_method'):
+            case['stage_method'] = 'copy'
+        if not case.get('time'):
+            case['time'] = 'latestTime'
+    return cases
+
+def get_slurm_shard(cases):
+    """Returns the cases handled by this SLURM array task (every SLURM_ARRAY_TASK_COUNT-th case), or all cases outside an array job."""
+    if 'SLURM_ARRAY_TASK_ID' not in os.environ:
+        return cases
+    task_index = int(os.environ['SLURM_ARRAY_TASK_ID']) - int(os.environ.get('SLURM_ARRAY_TASK_MIN',default=0))
+    task_count = int(os.environ.get('SLURM_ARRAY_TASK_COUNT',default=1))
+    print(f'[dataFoam] SLURM array task {task_index+1}/{task_count}')
+    return cases[task_index::task_count]
+
+def process_foam_case(case,write_fields_flag=True,field_workers=1,incremental_flag=False):
+    """Runs writeFields and saveDataset for one manifest entry. Output is logged to {data_save_path}/log.{dataset_prefix}.
+    Exceptions are caught so that a failing case does not stop the batch. Returns a summary dict for the case.
+    """
+    os.makedirs(case['data_save_path'],exist_ok=True)
+    logfile = os.path.join(case['data_save_path'],'log.'+case['dataset_prefix'])
+    start_time = time.perf_counter()
+    summary = {'case_name': case['case_name'], 'dataset_prefix': case['dataset_prefix'], 'log': logfile}
+    with open(logfile,'w') as log, contextlib.redirect_stdout(log):
+        try:
+            foam_data_case = MLDatasetFromFoamCase(data_save_path=case['data_save_path'],
+                                                   foam_parent_dir=case['foam_parent_dir'],
+                                                   case_name=case['case_name'],
+                                                   case_type=case['case_type'],
+                                                   write_fields_application=case['write_fields_application'],
+                                                   write_fields_flag=write_fields_flag,
+                                                   stage_method=case['stage_method'],
+                                                   incremental_flag=incremental_flag,
+                                                   time=case['time'])
+            foam_data_case.writeFields()
+            foam_data_case.saveDataset(dataset_prefix=case['dataset_prefix'],workers=field_workers)
+            summary['status'] = 'ok'
+        except Exception as error:
+            traceback.print_exc(file=log)
+            summary['status'] = 'failed'
+            summary['error'] = repr(error)
+    summary['time'] = time.perf_counter()-start_time
+    return summary
+
+def process_foam_case_isolated(case,*args):
+    """Runs process_foam_case in its own worker process, so a worker that dies (segfault, OOM kill...) only fails this case.
+    With one shared pool, a dead worker breaks the pool and every pending case fails with BrokenProcessPool.
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(process_foam_case,case,*args)
+        try:
+            return future.result()
+        except BrokenProcessPool as error:
+            return {'case_name': case['case_name'], 'dataset_prefix': case['dataset_prefix'], 'log': os.path.join(case['data_save_path'],'log.'+case['dataset_prefix']),
+                    'status': 'failed', 'error': 'worker process died: '+repr(error), 'time': 0.0}
+
+def process_foam_cases(cases,workers=None,write_fields_flag=True,field_workers=1,incremental_flag=False,report_file=None):
+    """Processes a list of manifest entries (see read_manifest), each case in its own worker process (see process_foam_case_isolated).
+    workers: number of cases processed concurrently, defaults to SLURM_CPUS_PER_TASK (or 1).
+    incremental_flag: only redo cases and fields whose inputs changed since the last run (see MLDatasetFromFoamCase).
+    Returns the list of per-case summaries, and prints a report at the end.
+    """
+    if workers is None:
+        workers = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+    cases = get_slurm_shard(cases)
+    print(f'[dataFoam] Processing {len(cases)} cases with {workers} worker(s)....')
+    start_time = time.perf_counter()
+    # Threads only wait on the per-case worker processes, and bound how many cases run at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_foam_case_isolated,case,write_fields_flag,field_workers,incremental_flag) for case in cases]
+        summaries = []
+        for case, future in zip(cases,futures):
+            try:
+                summaries.append(future.result())
+            except Exception as error:
+                # The worker process could not be started, e.g. out of memory
+                summaries.append({'case_name': case['case_name'], 'dataset_prefix': case['dataset_prefix'], 'status': 'failed', 'error': repr(error), 'time': 0.0})
+            print(f"[dataFoam] {summaries[-1]['dataset_prefix']}: {summaries[-1]['status']} ({summaries[-1]['time']:.1f} s)")
+
+    failed = [summary for summary in summaries if summary['status'] != 'ok']
+    print(f'================================================================')
+    print(f'[dataFoam] Processed {len(summaries)} cases in {time.perf_counter()-start_time:.1f} s, {len(failed)} failed.')
+    for summary in failed:
+        print(f"[dataFoam]     {summary['dataset_prefix']}: {summary['error']} (see {summary.get('log')})")
+    print(f'================================================================')
+    if report_file is not None:
+        with open(report_file,'w') as file:
+            json.dump(summaries,file,indent=4)
+    return summaries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run writeFields and saveDataset for every case in a csv manifest.')
+    parser.add_argument('manifest',help='csv file with columns '+', '.join(MANIFEST_COLUMNS)+' and optionally dataset_prefix, stage_method, time')
+    parser.add_argument('--workers',type=int,default=None,help='cases processed concurrently (default: SLURM_CPUS_PER_TASK or 1)')
+    parser.add_argument('--field-workers',type=int,default=1,help='processes used by saveDataset within each case')
+    parser.add_argument('--skip-write-fields',action='store_true',help='do not rerun the write_fields_application')
+    parser.add_argument('--incremental',action='store_true',help='skip cases and fields whose inputs are unchanged since the last run')
+    parser.add_argument('--report',default=None,help='json file for the summary report')
+    args = parser.parse_args()
+    summaries = process_foam_cases(read_manifest(args.manifest),
+                                   workers=args.workers,
+                                   write_fields_flag=not args.skip_write_fields,
+                                   field_workers=args.field_workers,
+                                   incremental_flag=args.incremental,
+                                   report_file=args.report)
+    sys.exit(1 if any(summary['status'] != 'ok' for summary in summaries) else 0)